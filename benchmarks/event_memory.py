@@ -0,0 +1,54 @@
+# event_memory.py
+#
+# Retained memory of one parsed schedule: the former per-event dicts of
+# icalendar values versus the compact Event objects built by parse_ics.
+# Run from the project root: python benchmarks/event_memory.py
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gc
+import tracemalloc
+
+from icalendar import Calendar
+
+from benchmarks.sample_ics import make_ics
+from src.schedule import parse_ics
+
+def parse_as_dicts(ics_content):
+    """Representation used before the Event type: one dict of icalendar values per VEVENT."""
+    events = []
+    for component in Calendar.from_ical(ics_content).walk():
+        if component.name == "VEVENT":
+            events.append({
+                'summary': component.get('summary', 'No summary'),
+                'dtstart': component.get('dtstart').dt,
+                'dtend': component.get('dtend').dt,
+                'location': component.get('location', 'No location'),
+                'description': component.get('description', 'No description'),
+            })
+    return events
+
+def retained_bytes(parse, ics_content, copies):
+    """Memory still allocated after parsing `copies` schedules and dropping the parser's temporaries."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [parse(ics_content) for _ in range(copies)]
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return (after - before) / copies
+
+if __name__ == '__main__':
+    ics_content = make_ics()
+    events = len(parse_ics(ics_content))
+    copies = 20
+    as_dicts = retained_bytes(parse_as_dicts, ics_content, copies)
+    as_events = retained_bytes(parse_ics, ics_content, copies)
+    print(f"{events} events per schedule, {copies} schedules kept")
+    print(f"dicts of icalendar values: {as_dicts / 1024:8.1f} KiB per schedule, {as_dicts / events:6.0f} B per event")
+    print(f"Event (__slots__, interned): {as_events / 1024:8.1f} KiB per schedule, {as_events / events:6.0f} B per event")
+    print(f"ratio: {as_dicts / as_events:.1f}x")
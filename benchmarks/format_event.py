@@ -0,0 +1,80 @@
+# format_event.py
+#
+# Per-event formatting cost: the former format_event, which classified the
+# summary and looked up the pair number on every call, versus the current one
+# that only reads fields resolved when the Event was built.
+# Run from the project root: python benchmarks/format_event.py
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import timeit
+
+from benchmarks.sample_ics import make_ics
+from src.schedule import Event, ScheduleFormatter, classify_summary, parse_ics
+
+def legacy_get_pair_number(start_time):
+    pairs = {
+        1: ("09:00", "10:30"),
+        2: ("10:40", "12:10"),
+        3: ("12:30", "14:00"),
+        4: ("14:10", "15:40"),
+        5: ("15:50", "17:20"),
+        6: ("17:25", "18:55"),
+        7: ("19:10", "20:30")
+    }
+    start_time_str = start_time.strftime('%H:%M')
+    for pair_number, (start, end) in pairs.items():
+        if start_time_str == start:
+            return pair_number
+    return None
+
+def legacy_format_event(event):
+    """format_event before the rule table (without the error handling)."""
+    start_time_str = event.start.strftime('%H:%M')
+    end_time_str = event.end.strftime('%H:%M')
+    summary = event.summary
+    summary_lower = summary.lower()
+    if 'зач' in summary_lower.split()[0]:
+        emoji, category = '✏️', 'Зачет'
+        summary = ' '.join(summary.split()[1:]) if len(summary.split()) > 1 else summary
+    elif 'физ' in summary_lower or 'элективные курсы по физической культуре' in summary_lower:
+        emoji, category = '💪', 'Физкультура'
+        summary = ' '.join(summary.split()[1:]) if len(summary.split()) > 1 else summary
+    elif 'лек' in summary_lower.split()[0] or 'лек.' in summary_lower.split()[0]:
+        emoji, category = '📚', 'Лекция'
+        summary = ' '.join(summary.split()[1:]) if len(summary.split()) > 1 else summary
+    elif 'пр' in summary_lower.split()[0] or 'пр.' in summary_lower.split()[0] or 'прак' in summary_lower.split()[0]:
+        emoji, category = '💻', 'Практика'
+        summary = ' '.join(summary.split()[1:]) if len(summary.split()) > 1 else summary
+    elif 'лаб' in summary_lower.split()[0]:
+        emoji, category = '❗', 'Лабораторная'
+        summary = ' '.join(summary.split()[1:]) if len(summary.split()) > 1 else summary
+    else:
+        emoji, category = '🔔', 'Прочее'
+    summary = f"{summary} ({category})"
+    pair_number = legacy_get_pair_number(event.start)
+    time_prefix = f"{pair_number} пара: " if pair_number else ""
+    return f" 🕘 {time_prefix}{start_time_str}-{end_time_str}\n{emoji} {summary}\nАудитория: {event.location}\n{event.description}\n"
+
+def per_event(func, events, repeat=20):
+    seconds = min(timeit.repeat(lambda: [func(event) for event in events], number=1, repeat=repeat))
+    return seconds / len(events)
+
+if __name__ == '__main__':
+    events = list(parse_ics(make_ics()))
+    assert all(legacy_format_event(event) == ScheduleFormatter.format_event(event) for event in events)
+
+    legacy = per_event(legacy_format_event, events)
+    current = per_event(ScheduleFormatter.format_event, events)
+    print(f"{len(events)} events")
+    print(f"format_event, classify on every call: {legacy * 1e6:6.2f} us per event")
+    print(f"format_event, precomputed fields:     {current * 1e6:6.2f} us per event")
+    print(f"speedup: {legacy / current:.1f}x")
+
+    # What moved into parsing: classification (cached per distinct summary) and the pair lookup
+    args = [(e.summary, e.start, e.end, e.location, e.description) for e in events]
+    classify_summary.cache_clear()
+    build = min(timeit.repeat(lambda: [Event(*a) for a in args], number=1, repeat=20)) / len(events)
+    print(f"Event construction incl. classification: {build * 1e6:6.2f} us per event")
@@ -0,0 +1,41 @@
+# parse_ics.py
+#
+# Parse CPU time and peak memory of Calendar.from_ical versus the line scanner
+# in parse_ics, for the whole semester and for narrower windows.
+# Run from the project root: python benchmarks/parse_ics.py
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import timeit
+import tracemalloc
+from datetime import date, timedelta
+
+from benchmarks.sample_ics import make_ics
+from src.schedule import EventIndex, _parse_ics_full, _parse_ics_stream, _parse_window
+
+def measure(parse, repeat=20):
+    seconds = min(timeit.repeat(parse, number=1, repeat=repeat))
+    tracemalloc.start()
+    events = parse()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak, len(events)
+
+if __name__ == '__main__':
+    ics_content = make_ics()
+    day = date(2026, 10, 14)
+    week_start = day - timedelta(days=day.weekday())
+    cache_start, cache_end = _parse_window(day)
+    cases = [
+        ("Calendar.from_ical, semester", lambda: EventIndex(_parse_ics_full(ics_content))),
+        ("line scanner, semester", lambda: EventIndex(_parse_ics_stream(ics_content))),
+        ("line scanner, cache window", lambda: EventIndex(_parse_ics_stream(ics_content, cache_start, cache_end))),
+        ("line scanner, one week", lambda: EventIndex(_parse_ics_stream(ics_content, week_start, week_start + timedelta(days=6)))),
+        ("line scanner, one day", lambda: EventIndex(_parse_ics_stream(ics_content, day, day))),
+    ]
+    print(f"ICS body: {len(ics_content) / 1024:.0f} KiB")
+    for name, parse in cases:
+        seconds, peak, events = measure(parse)
+        print(f"{name:30} {seconds * 1000:8.2f} ms  peak {peak / 1024:8.0f} KiB  {events:4d} events")
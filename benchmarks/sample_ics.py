@@ -0,0 +1,46 @@
+# sample_ics.py
+
+import random
+from datetime import datetime, timedelta
+
+SUBJECTS = [
+    "Лек. Математический анализ", "Пр. Математический анализ", "Лек. Программирование на Python",
+    "Лаб. Программирование на Python", "Пр. Базы данных", "Лек. Базы данных", "Лаб. Физика",
+    "Зач. История России", "Элективные курсы по физической культуре и спорту",
+    "Пр. Иностранный язык", "Лек. Операционные системы", "Консультация",
+]
+TEACHERS = ["Иванов И.И.", "Петров А.С.", "Сидорова Е.В.", "Кузнецов Д.А.", "Смирнова О.Н."]
+GROUPS = ["ПИ-23", "ИВТ-23", "ПИ-22", "ИСТ-24"]
+# Start times of the pairs in UTC (MSK - 3h)
+PAIR_STARTS_UTC = [(6, 0), (7, 40), (9, 30), (11, 10), (12, 50), (14, 25), (16, 10)]
+
+def make_ics(days=150, pairs_per_day=5, start=datetime(2026, 9, 1), seed=1):
+    """
+    Build a synthetic Unitech-like ICS body. The defaults give a teacher's
+    semester of roughly 750 events.
+    """
+    rng = random.Random(seed)
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//Unitech//Rasp//RU"]
+    uid = 0
+    for day_offset in range(days):
+        day = start + timedelta(days=day_offset)
+        if day.weekday() == 6:
+            continue
+        for pair in sorted(rng.sample(range(len(PAIR_STARTS_UTC)), pairs_per_day)):
+            hour, minute = PAIR_STARTS_UTC[pair]
+            dtstart = day.replace(hour=hour, minute=minute)
+            dtend = dtstart + timedelta(minutes=90)
+            uid += 1
+            lines += [
+                "BEGIN:VEVENT",
+                f"UID:{uid}@es.unitech-mo.ru",
+                f"DTSTAMP:{start:%Y%m%dT%H%M%S}Z",
+                f"DTSTART:{dtstart:%Y%m%dT%H%M%S}Z",
+                f"DTEND:{dtend:%Y%m%dT%H%M%S}Z",
+                f"SUMMARY:{rng.choice(SUBJECTS)}",
+                f"LOCATION:Корпус {rng.randint(1, 4)}\\, ауд. {rng.randint(100, 130)}",
+                f"DESCRIPTION:Преподаватель: {rng.choice(TEACHERS)}\\nГруппа: {rng.choice(GROUPS)}",
+                "END:VEVENT",
+            ]
+    lines.append("END:VCALENDAR")
+    return ("\r\n".join(lines) + "\r\n").encode('utf-8')
@@ -1,5 +1,7 @@
 # config.py
 
+import os
+
 BOT_VERSION = "1.43"
 LAST_UPDATED = "02.03.2026"
 
@@ -9,8 +11,102 @@ CHANGE_GROUP_WAITING = 3  # Добавлено для смены группы
 TEACHER_SELECT_WAITING = 4  # Для выбора преподавателя
 STUDENT_GROUP_WAITING = 5  # Для ввода названия группы студентом
 
+MESSAGE_MAX_LENGTH = 4096  # Лимит Telegram на длину сообщения; длинное расписание отправляется несколькими сообщениями по дням
+
+# Режим получения обновлений: "polling" (по умолчанию) или "webhook" (переменная окружения BOT_MODE)
+# В режиме webhook Telegram присылает обновления на WEBHOOK_URL/WEBHOOK_PATH, бот слушает WEBHOOK_LISTEN:WEBHOOK_PORT
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")  # Публичный HTTPS-адрес бота, например https://bot.example.com
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET_TOKEN = os.environ.get("WEBHOOK_SECRET_TOKEN", "")  # 1-256 символов A-Z, a-z, 0-9, _ и -; Telegram присылает его в каждом запросе
+
 LOGS_DIR = "Logs"
 API_KEY_FILE = 'api_key_journal_unitech.txt'
-USERS_JSON_FILE = 'users.json'
+USERS_JSON_FILE = 'users.json'  # Старое хранилище, импортируется в USERS_DB_FILE при первом запуске
+USERS_DB_FILE = 'Data/users.db'  # SQLite (WAL) с настройками чатов
+CONVERSATIONS_FILE = 'Data/conversations.pickle'  # Состояние диалогов и chat_data между перезапусками (без Redis)
+USERS_FLUSH_INTERVAL = 5  # Как часто (в секундах) изменения настроек из памяти записываются в базу
 DEVELOPER_CHAT_ID = "-4956911463"  # ID чата разработчика. Измените на свой ID в config.py для своего проекта
 DEVELOPER_USERNAME = "@BlackNetRus"  # Username разработчика для обратной связи
+
+# Кэш распарсенных ICS-расписаний (ключ: ("group", id), ("student", id) или ("teacher", id))
+SCHEDULE_CACHE_TTL = 30 * 60  # Время жизни записи в секундах
+SCHEDULE_CACHE_MAX_SIZE = 512  # Максимум расписаний в памяти (вытеснение LRU)
+SCHEDULE_CACHE_DIR = "Cache"  # Последние успешно скачанные ICS для работы при недоступности Unitech
+SCHEDULE_RETRY_INTERVAL = 60  # Не чаще одного фонового обновления устаревшего расписания за N секунд
+
+# Кэш готовых текстов расписания (ключ: хэш ICS, вид, дата)
+RENDER_CACHE_TTL = 6 * 60 * 60
+RENDER_CACHE_MAX_SIZE = 4096
+
+# Разбор ICS и форматирование недель вне потока event loop (большие расписания преподавателей не задерживают ответы)
+# "off" — в event loop, "thread" — в пуле потоков, "process" — в пуле процессов (разбор не держит GIL основного процесса)
+SCHEDULE_POOL = os.environ.get("SCHEDULE_POOL", "off")
+SCHEDULE_POOL_WORKERS = int(os.environ.get("SCHEDULE_POOL_WORKERS", "2"))
+
+# Время начала и конца пар (МСК)
+PAIR_TIMES = {
+    1: ("09:00", "10:30"),
+    2: ("10:40", "12:10"),
+    3: ("12:30", "14:00"),
+    4: ("14:10", "15:40"),
+    5: ("15:50", "17:20"),
+    6: ("17:25", "18:55"),
+    7: ("19:10", "20:30")
+}
+
+# Тип занятия по названию из ICS: (где искать, подстроки, эмодзи, категория)
+# "first_word" — в первом слове названия, "anywhere" — во всём названии (без учета регистра).
+# Правила проверяются по порядку, срабатывает первое; у найденного типа первое слово убирается из названия.
+EVENT_CATEGORY_RULES = [
+    ("first_word", ["зач"], "✏️", "Зачет"),
+    ("anywhere", ["физ", "элективные курсы по физической культуре"], "💪", "Физкультура"),
+    ("first_word", ["лек"], "📚", "Лекция"),
+    ("first_word", ["пр", "прак"], "💻", "Практика"),
+    ("first_word", ["лаб"], "❗", "Лабораторная")
+]
+EVENT_DEFAULT_CATEGORY = ("🔔", "Прочее")  # Если ни одно правило не подошло (название не меняется)
+
+TEACHER_SEARCH_LIMIT = 10  # Сколько преподавателей показывать кнопками при поиске по имени
+
+# HTTP-клиент для API Unitech
+UNITECH_API_URL = "https://es.unitech-mo.ru/api"
+HTTP_TIMEOUT = 10  # Таймаут запроса по умолчанию в секундах
+HTTP_CONNECT_TIMEOUT = 5  # Таймаут установки соединения в секундах
+HTTP_MAX_CONNECTIONS = 20  # Размер пула соединений
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 10  # Сколько соединений держать открытыми (keep-alive)
+HTTP_MAX_CONCURRENCY = 10  # Максимум одновременных запросов к Unitech
+# Сколько обновлений Telegram обрабатывается одновременно (обновления одного чата всё равно идут по очереди);
+# больше HTTP_MAX_CONCURRENCY: большинство ответов берётся из кэша и не ждёт Unitech
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", str(4 * HTTP_MAX_CONCURRENCY)))
+
+# Прогрев кэша расписаний перед утренним пиком (время МСК, JobQueue)
+# Последний прогрев должен быть не раньше чем за SCHEDULE_CACHE_TTL до начала первой пары
+PREFETCH_TIMES = ["07:00", "07:45", "08:30"]
+PREFETCH_CONCURRENCY = 3  # Сколько расписаний скачивается одновременно
+PREFETCH_RATE_LIMIT = 2  # Не больше N новых запросов к Unitech в секунду
+
+# Справочник групп: название -> groupID и ID студента, по которому скачивается расписание группы
+GROUPS_CACHE_TTL = 6 * 60 * 60  # Как часто обновляется список групп (фоновая задача JobQueue)
+GROUP_STUDENT_CACHE_TTL = 24 * 60 * 60  # Сколько хранится ID студента группы
+GROUP_STUDENT_CACHE_MAX_SIZE = 2048
+TEACHERS_CACHE_TTL = 6 * 60 * 60  # Как часто обновляется список преподавателей (фоновая задача JobQueue)
+
+# Общее состояние для нескольких экземпляров бота (например, реплик в режиме webhook)
+# "memory" — без общего хранилища, один экземпляр хранит всё локально, "redis" — настройки чатов, скачанные расписания
+# и состояние диалогов хранятся на сервере Redis (или совместимом) по адресу REDIS_URL
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "memory")
+REDIS_URL = os.environ.get("REDIS_URL") or "redis://localhost:6379/0"
+REDIS_TIMEOUT = 5  # Таймаут соединения и ответа Redis в секундах
+STATE_KEY_PREFIX = "unitech:"  # Префикс всех ключей бота в Redis
+SHARED_SCHEDULE_TTL = 7 * 24 * 60 * 60  # Сколько хранится общая копия ICS (как копия на диске, на случай недоступности Unitech)
+CONVERSATION_STATE_TTL = 24 * 60 * 60  # Незавершённый диалог (ввод группы, отзыва и т.д.) забывается через N секунд
+PERSISTENCE_UPDATE_INTERVAL = 5  # Как часто (в секундах) состояние диалогов записывается в хранилище
+
+# Метрики в формате Prometheus: GET http://<адрес>:METRICS_PORT/metrics (0 — выключено)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9464"))
+# По умолчанию доступны только локально; для сбора из другого контейнера укажите 0.0.0.0 и не публикуйте порт наружу
+METRICS_LISTEN = os.environ.get("METRICS_LISTEN", "127.0.0.1")
+METRICS_READ_TIMEOUT = 5  # Сколько секунд ждать запрос от клиента, затем соединение закрывается
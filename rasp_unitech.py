@@ -1,120 +1,191 @@
 # rasp_unitech.py
 
 import locale
+import re
 import sys
 import os
 
+from telegram import Update
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ConversationHandler
+    ApplicationBuilder, CommandHandler, MessageHandler, filters, CallbackQueryHandler, TypeHandler
 )
 
-from config import FEEDBACK_WAITING, DAY_SELECTION, CHANGE_GROUP_WAITING, TEACHER_SELECT_WAITING, STUDENT_GROUP_WAITING
+from config import FEEDBACK_WAITING, DAY_SELECTION, CHANGE_GROUP_WAITING, TEACHER_SELECT_WAITING, STUDENT_GROUP_WAITING, USERS_FLUSH_INTERVAL, GROUPS_CACHE_TTL, TEACHERS_CACHE_TTL, CONCURRENT_UPDATES
+from config import BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_SECRET_TOKEN
 from src.logging_setup import setup_logging
 from src.utils import load_api_key
+from src.http_client import close_client
+from src.prefetch import schedule_prefetch_jobs
+from src.groups import refresh_groups, migrate_group_keys
+from src.get_student_id import refresh_teachers
+from src.storage import get_user_store, flush_users, close_user_store
+from src.backends import close_backend
+from src.workers import shutdown_pool
+from src.dispatch import ChatOrderedUpdateProcessor
+from src.metrics import InstrumentedRequest, instrument_handler, start_metrics_server, stop_metrics_server
+from src.persistence import get_persistence, SharedConversationHandler, load_conversation_states
 from src.handlers import (
     start, info, change_command, feedback_start, feedback_receive, feedback_cancel,
     today_command, tomorrow_command, week_command, next_week_command, day_command,
-    day_selection_start, day_selection, day_selection_text, handle_callback, text_handler, error_handler,
+    day_selection_start, day_selection, day_selection_text, handle_callback, text_handler, addressed_to_bot, error_handler,
     change_start, change_receive, change_student_start, change_teacher_start, 
     change_teacher_receive, teacher_select_receive
 )
 
-# Установка локали для русского языка
-try:
-    locale.setlocale(locale.LC_TIME, 'Russian_Russia.1251')
-except locale.Error:
-    try:
-        locale.setlocale(locale.LC_TIME, 'ru_RU.UTF-8')
-    except locale.Error:
-        locale.setlocale(locale.LC_TIME, '')
-
 logger = setup_logging()
-TELEGRAM_TOKEN = load_api_key()
+
+async def post_shutdown(application):
+    await stop_metrics_server()
+    await close_client()
+    close_user_store()
+    close_backend()
+    shutdown_pool()
+
+def run_webhook(app):
+    """
+    Receive updates over HTTP instead of long polling (BOT_MODE=webhook).
+    Requests without the right X-Telegram-Bot-Api-Secret-Token are rejected.
+    """
+    if not WEBHOOK_URL or not re.match(r'^[A-Za-z0-9_-]{1,256}$', WEBHOOK_SECRET_TOKEN):
+        logger.error("webhook mode needs WEBHOOK_URL and a valid WEBHOOK_SECRET_TOKEN", extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+        print("Для BOT_MODE=webhook задайте WEBHOOK_URL и WEBHOOK_SECRET_TOKEN (1-256 символов A-Z, a-z, 0-9, _ и -).")
+        exit(1)
+    webhook_url = f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}"
+    logger.info("starting webhook on %s:%s, url %s", WEBHOOK_LISTEN, WEBHOOK_PORT, webhook_url, extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+    app.run_webhook(
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        url_path=WEBHOOK_PATH,
+        webhook_url=webhook_url,
+        secret_token=WEBHOOK_SECRET_TOKEN,
+        drop_pending_updates=False
+    )
 
 if __name__ == '__main__':
+    # Here and not at import: spawned schedule pool workers re-import this module as __mp_main__
+    # Установка локали для русского языка
+    try:
+        locale.setlocale(locale.LC_TIME, 'Russian_Russia.1251')
+    except locale.Error:
+        try:
+            locale.setlocale(locale.LC_TIME, 'ru_RU.UTF-8')
+        except locale.Error:
+            locale.setlocale(locale.LC_TIME, '')
+    TELEGRAM_TOKEN = load_api_key()
+
     logger.info("bot started", extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+    get_user_store()  # Load all user settings into memory once
+    # Conversation states survive restarts: a redeploy does not drop users mid-flow
+    app = (
+        ApplicationBuilder().token(TELEGRAM_TOKEN).persistence(get_persistence())
+        # Bot API calls made by handlers are timed per method; long polling keeps its own request object
+        .request(InstrumentedRequest(connection_pool_size=256))
+        # Chats are served in parallel while awaiting Unitech or the schedule pool; one chat's updates stay in order
+        .concurrent_updates(ChatOrderedUpdateProcessor(CONCURRENT_UPDATES))
+        .post_init(start_metrics_server).post_shutdown(post_shutdown).build()
+    )
     
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("info", info))
-    app.add_handler(CommandHandler("change", change_command))
-    app.add_handler(ConversationHandler(
+    # With the Redis backend, conversation states are read before any handler matches an update
+    app.add_handler(TypeHandler(Update, load_conversation_states), group=-1)
+    app.add_handler(CommandHandler("start", instrument_handler(start)))
+    app.add_handler(CommandHandler("info", instrument_handler(info)))
+    app.add_handler(CommandHandler("change", instrument_handler(change_command)))
+    app.add_handler(SharedConversationHandler(
         entry_points=[
-            CommandHandler("feedback", feedback_start),
-            CallbackQueryHandler(feedback_start, pattern="^feedback$")
+            CommandHandler("feedback", instrument_handler(feedback_start)),
+            CallbackQueryHandler(instrument_handler(feedback_start), pattern="^feedback$")
         ],
         states={
             FEEDBACK_WAITING: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, feedback_receive),
-                CommandHandler("cancel", feedback_cancel)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, instrument_handler(feedback_receive)),
+                CommandHandler("cancel", instrument_handler(feedback_cancel))
             ],
         },
-        fallbacks=[CommandHandler("cancel", feedback_cancel)],
-        per_message=False
+        fallbacks=[CommandHandler("cancel", instrument_handler(feedback_cancel))],
+        per_message=False,
+        name="feedback",
+        persistent=True
     ))
-    app.add_handler(ConversationHandler(
+    app.add_handler(SharedConversationHandler(
         entry_points=[
-            CommandHandler("day", day_selection_start),
-            CallbackQueryHandler(day_selection_start, pattern="^day$")
+            CommandHandler("day", instrument_handler(day_selection_start)),
+            CallbackQueryHandler(instrument_handler(day_selection_start), pattern="^day$")
         ],
         states={
             DAY_SELECTION: [
-                CallbackQueryHandler(day_selection),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, day_selection_text)
+                CallbackQueryHandler(instrument_handler(day_selection)),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, instrument_handler(day_selection_text))
             ],
         },
-        fallbacks=[CommandHandler("cancel", feedback_cancel)],
-        per_message=False
+        fallbacks=[CommandHandler("cancel", instrument_handler(feedback_cancel))],
+        per_message=False,
+        name="day_selection",
+        persistent=True
     ))
     # Separate handler for student group change
-    app.add_handler(ConversationHandler(
+    app.add_handler(SharedConversationHandler(
         entry_points=[
-            CallbackQueryHandler(change_student_start, pattern="^change_student$")
+            CallbackQueryHandler(instrument_handler(change_student_start), pattern="^change_student$")
         ],
         states={
             STUDENT_GROUP_WAITING: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, change_receive),
-                CommandHandler("cancel", feedback_cancel)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, instrument_handler(change_receive)),
+                CommandHandler("cancel", instrument_handler(feedback_cancel))
             ],
         },
-        fallbacks=[CommandHandler("cancel", feedback_cancel)],
-        per_message=False
+        fallbacks=[CommandHandler("cancel", instrument_handler(feedback_cancel))],
+        per_message=False,
+        name="student_group",
+        persistent=True
     ))
     # Separate handler for teacher selection
-    app.add_handler(ConversationHandler(
+    app.add_handler(SharedConversationHandler(
         entry_points=[
-            CallbackQueryHandler(change_teacher_start, pattern="^change_teacher$")
+            CallbackQueryHandler(instrument_handler(change_teacher_start), pattern="^change_teacher$")
         ],
         states={
             TEACHER_SELECT_WAITING: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, change_teacher_receive),
-                CallbackQueryHandler(teacher_select_receive, pattern="^teacher_select_"),
-                CommandHandler("cancel", feedback_cancel)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, instrument_handler(change_teacher_receive)),
+                CallbackQueryHandler(instrument_handler(teacher_select_receive), pattern="^teacher_select_"),
+                CommandHandler("cancel", instrument_handler(feedback_cancel))
             ],
         },
-        fallbacks=[CommandHandler("cancel", feedback_cancel)],
-        per_message=False
+        fallbacks=[CommandHandler("cancel", instrument_handler(feedback_cancel))],
+        per_message=False,
+        name="teacher_select",
+        persistent=True
     ))
     # Original handler for showing the student/teacher selection menu
-    app.add_handler(ConversationHandler(
+    app.add_handler(SharedConversationHandler(
         entry_points=[
-            CallbackQueryHandler(change_start, pattern="^change$")
+            CallbackQueryHandler(instrument_handler(change_start), pattern="^change$")
         ],
         states={
             CHANGE_GROUP_WAITING: [
-                CallbackQueryHandler(change_student_start, pattern="^change_student$"),
-                CallbackQueryHandler(change_teacher_start, pattern="^change_teacher$")
+                CallbackQueryHandler(instrument_handler(change_student_start), pattern="^change_student$"),
+                CallbackQueryHandler(instrument_handler(change_teacher_start), pattern="^change_teacher$")
             ],
         },
-        fallbacks=[CommandHandler("cancel", feedback_cancel)],
-        per_message=False
+        fallbacks=[CommandHandler("cancel", instrument_handler(feedback_cancel))],
+        per_message=False,
+        name="change_menu",
+        persistent=True
     ))
-    app.add_handler(CommandHandler("today", today_command))
-    app.add_handler(CommandHandler("tomorrow", tomorrow_command))
-    app.add_handler(CommandHandler("week", week_command))
-    app.add_handler(CommandHandler("next_week", next_week_command))
-    app.add_handler(CallbackQueryHandler(handle_callback))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_handler))
+    app.add_handler(CommandHandler("today", instrument_handler(today_command)))
+    app.add_handler(CommandHandler("tomorrow", instrument_handler(tomorrow_command)))
+    app.add_handler(CommandHandler("week", instrument_handler(week_command)))
+    app.add_handler(CommandHandler("next_week", instrument_handler(next_week_command)))
+    app.add_handler(CallbackQueryHandler(instrument_handler(handle_callback)))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND & addressed_to_bot, instrument_handler(text_handler)))
     app.add_error_handler(error_handler)
+    schedule_prefetch_jobs(app.job_queue)
+    app.job_queue.run_repeating(flush_users, interval=USERS_FLUSH_INTERVAL, name="flush_users")
+    app.job_queue.run_repeating(refresh_groups, interval=GROUPS_CACHE_TTL, first=0, name="refresh_groups")
+    app.job_queue.run_repeating(refresh_teachers, interval=TEACHERS_CACHE_TTL, first=0, name="refresh_teachers")
+    app.job_queue.run_once(migrate_group_keys, when=0, name="migrate_group_keys")
     
-    app.run_polling(timeout=20, drop_pending_updates=True)
+    # Updates that arrived while the bot was down are processed, not dropped
+    if BOT_MODE == "webhook":
+        run_webhook(app)
+    else:
+        app.run_polling(timeout=20, drop_pending_updates=False)
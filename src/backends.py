@@ -0,0 +1,230 @@
+# backends.py
+
+import itertools
+import socket
+import threading
+from urllib.parse import urlparse, unquote
+
+from config import STATE_BACKEND, REDIS_URL, REDIS_TIMEOUT, STATE_KEY_PREFIX
+from src.utils import logger
+
+class RedisError(Exception):
+    pass
+
+class RespConnection:
+    """
+    Minimal blocking client for the Redis protocol (RESP2): one socket, one
+    command at a time under a lock, reconnect once on a broken connection.
+    Works with Redis, Valkey, KeyDB or any server speaking RESP.
+    """
+
+    def __init__(self, url, timeout=REDIS_TIMEOUT):
+        parsed = urlparse(url)
+        if parsed.scheme != "redis":
+            raise ValueError(f"Unsupported Redis URL scheme: {parsed.scheme!r}")
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock = None
+        self._reader = None
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile('rb')
+        if self.password:
+            self._call(("AUTH", self.username, self.password) if self.username else ("AUTH", self.password))
+        if self.db:
+            self._call(("SELECT", self.db))
+
+    def _disconnect(self):
+        if self._sock is not None:
+            try:
+                self._reader.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._reader = None
+
+    def execute(self, *args):
+        return self.transaction(lambda call: call(*args))
+
+    def transaction(self, func):
+        """
+        Run func(call) with the connection held, so a sequence of commands
+        (WATCH ... MULTI ... EXEC) is not interleaved with other threads.
+        call(*args) sends one command and returns its reply. The whole
+        sequence is retried once on a new connection if the old one broke.
+        """
+        with self._lock:
+            for attempt in (1, 2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return func(lambda *args: self._call(args))
+                except (OSError, EOFError) as e:
+                    self._disconnect()
+                    if attempt == 2:
+                        raise RedisError(f"Redis connection to {self.host}:{self.port} failed: {e}") from e
+                except RedisError:
+                    # The server rejected a command: drop the connection so no WATCH or MULTI stays open on it
+                    self._disconnect()
+                    raise
+
+    def _call(self, args):
+        self._sock.sendall(self._encode(args))
+        return self._read_reply()
+
+    @staticmethod
+    def _encode(args):
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode('utf-8')
+            elif isinstance(arg, int):
+                arg = str(arg).encode('ascii')
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise EOFError("connection closed by server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode('utf-8')
+        if kind == b"-":
+            raise RedisError(payload.decode('utf-8', 'replace'))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length == -1:
+                return None
+            data = self._reader.read(length + 2)
+            if len(data) != length + 2:
+                raise EOFError("connection closed by server")
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length == -1:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RedisError(f"Unexpected reply type: {line!r}")
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+class RedisBackend:
+    """
+    Key-value store on a Redis-protocol server, so that several bot workers
+    (e.g. webhook replicas) share user settings, downloaded schedules and
+    conversation state. Values are bytes, keys may expire. All keys get
+    STATE_KEY_PREFIX.
+    """
+
+    def __init__(self, url, prefix=STATE_KEY_PREFIX):
+        self.prefix = prefix
+        self._conn = RespConnection(url)
+        self.address = f"{self._conn.host}:{self._conn.port}"
+
+    def get(self, key):
+        return self._conn.execute("GET", self.prefix + key)
+
+    def mget(self, keys):
+        if not keys:
+            return []
+        return self._conn.execute("MGET", *(self.prefix + key for key in keys))
+
+    def set(self, key, value, ttl=None, only_if_missing=False):
+        """Store a value; with only_if_missing, return False if the key already exists."""
+        args = ["SET", self.prefix + key, value]
+        if ttl:
+            args += ["PX", int(ttl * 1000)]
+        if only_if_missing:
+            args.append("NX")
+        return self._conn.execute(*args) is not None
+
+    def delete(self, key):
+        self._conn.execute("DEL", self.prefix + key)
+
+    def scan(self, prefix):
+        """All keys starting with prefix."""
+        keys = []
+        cursor = b"0"
+        while True:
+            cursor, batch = self._conn.execute("SCAN", cursor, "MATCH", self._glob(self.prefix + prefix) + "*", "COUNT", 1000)
+            keys.extend(key.decode('utf-8')[len(self.prefix):] for key in batch)
+            if cursor == b"0":
+                return keys
+
+    def get_hash(self, key):
+        """All fields of a hash as {field: bytes}, {} if there is none."""
+        return self._pairs(self._conn.execute("HGETALL", self.prefix + key))
+
+    def get_hashes(self, keys):
+        replies = self._conn.transaction(lambda call: [call("HGETALL", self.prefix + key) for key in keys])
+        return [self._pairs(reply) for reply in replies]
+
+    @staticmethod
+    def _pairs(reply):
+        """HGETALL reply [field, value, ...] as {field: value}."""
+        return {reply[i].decode('utf-8'): reply[i + 1] for i in range(0, len(reply), 2)}
+
+    def update_hash(self, key, values, remove=(), only_if_missing=False):
+        """
+        HDEL + HSET in one MULTI/EXEC, so concurrent updates of other fields
+        by other workers are never lost. only_if_missing checks the key under
+        WATCH: if another worker creates it first, EXEC is aborted.
+        """
+        key = self.prefix + key
+        def run(call):
+            if only_if_missing:
+                call("WATCH", key)
+                if call("EXISTS", key):
+                    call("UNWATCH")
+                    return False
+            call("MULTI")
+            if remove:
+                call("HDEL", key, *remove)
+            if values:
+                call("HSET", key, *itertools.chain.from_iterable(values.items()))
+            return call("EXEC") is not None
+        return self._conn.transaction(run)
+
+    @staticmethod
+    def _glob(text):
+        """Escape glob metacharacters so a key prefix matches literally in SCAN MATCH."""
+        return "".join("\\" + char if char in "*?[]\\" else char for char in text)
+
+    def close(self):
+        self._conn.close()
+
+_backend = None
+
+def get_backend():
+    """
+    The shared state backend selected by STATE_BACKEND, created on first use:
+    a RedisBackend for "redis", None for "memory" (a single worker keeps its
+    state in SQLite, the Cache directory and the conversations pickle).
+    """
+    global _backend
+    if _backend is None:
+        if STATE_BACKEND == "redis":
+            _backend = RedisBackend(REDIS_URL)
+            logger.info("using Redis state backend at %s", _backend.address, extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+        elif STATE_BACKEND != "memory":
+            raise ValueError(f"Unknown STATE_BACKEND: {STATE_BACKEND!r}")
+    return _backend
+
+def close_backend():
+    global _backend
+    if _backend is not None:
+        _backend.close()
+        _backend = None
@@ -0,0 +1,56 @@
+# dispatch.py
+
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Update processor for ApplicationBuilder.concurrent_updates: updates of
+    different chats are handled concurrently (up to max_concurrent_updates),
+    so one slow Unitech response or schedule parse does not hold up other
+    chats. Updates of one chat still run one at a time in arrival order,
+    which ConversationHandler relies on: the next message of a flow must
+    see the state the previous one left.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}
+        self._waiting = {}
+
+    @staticmethod
+    def _chat_key(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat is not None:
+            return ("chat", update.effective_chat.id)
+        if update.effective_user is not None:
+            return ("user", update.effective_user.id)
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._chat_key(update)
+        if key is None:
+            await coroutine
+            return
+        # asyncio.Lock wakes waiters in FIFO order, and updates reach here in the order they were fetched
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        try:
+            async with lock:
+                await coroutine
+        finally:
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                del self._waiting[key]
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -1,112 +1,132 @@
-import requests
-import json
+import time
 
-# Cache for teachers list
-_teachers_cache = None
+import httpx
 
-def get_teachers():
+from config import TEACHERS_CACHE_TTL
+from src import http_client
+from src.cache import SingleFlight
+from src.groups import group_directory
+from src.teacher_index import TeacherIndex
+from src.utils import logger
+
+# Search index over the teachers list, rebuilt every TEACHERS_CACHE_TTL seconds
+_teacher_index = None
+_teacher_index_loaded_at = None
+_teacher_flight = SingleFlight()
+
+async def get_teachers():
     """
     Fetch list of teachers from the API.
     Returns a list of teacher dictionaries with name, id, and kaf.
     """
-    global _teachers_cache
-    if _teachers_cache is not None:
-        return _teachers_cache
+    index = await get_teacher_index()
+    return index.teachers if index is not None else []
+
+async def _load_teacher_index():
+    global _teacher_index, _teacher_index_loaded_at
+    response = await http_client.get("/raspTeacherlist")
+    response.raise_for_status()
+    data = response.json()
+    
+    _teacher_index = TeacherIndex(data.get("data", []))
+    _teacher_index_loaded_at = time.monotonic()
+    return _teacher_index
+
+async def get_teacher_index():
+    """
+    Return the TeacherIndex over the teachers list, refetching the list once
+    it is older than TEACHERS_CACHE_TTL; concurrent callers share one request.
+    Falls back to the previous list if Unitech is unavailable.
+    Returns None if the list has never been fetched.
+    """
+    if _teacher_index is not None and time.monotonic() - _teacher_index_loaded_at < TEACHERS_CACHE_TTL:
+        return _teacher_index
     
-    url = "https://es.unitech-mo.ru/api/raspTeacherlist"
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
-        teachers = data.get("data", [])
-        _teachers_cache = teachers
-        return teachers
-    except requests.RequestException as e:
+        return await _teacher_flight.do("teachers", _load_teacher_index)
+    except httpx.HTTPError as e:
+        if _teacher_index is not None:
+            logger.warning("teachers refresh failed, using list from %.0fs ago", time.monotonic() - _teacher_index_loaded_at, extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+            return _teacher_index
         print(f"Error fetching teachers: {e}")
-        return []
+        return None
 
-def find_teacher(search_name):
+async def refresh_teachers(context=None):
+    """JobQueue callback: keep the teachers list fresh so teacher search needs no request."""
+    try:
+        await _teacher_flight.do("teachers", _load_teacher_index)
+    except Exception as e:
+        logger.warning("failed to refresh teachers list: %s", str(e), extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+
+async def find_teacher(search_name, limit=None):
     """
-    Find teacher(s) by name (partial match).
-    Returns a list of matching teachers.
+    Find teacher(s) by name: surname, name, initials or a prefix of them,
+    tolerating ё/е and one typo per word.
+    Returns a list of matching teachers, best match first (at most `limit`).
     """
-    teachers = get_teachers()
-    if not teachers:
+    index = await get_teacher_index()
+    if index is None:
         return []
-    
-    search_lower = search_name.lower()
-    matches = []
-    
-    for teacher in teachers:
-        name = teacher.get("name", "")
-        if search_lower in name.lower():
-            matches.append(teacher)
-    
-    return matches
+    return index.search(search_name, limit)
 
-def get_group_id(group_name):
+async def get_teacher(teacher_id):
     """
-    Fetch groupID from the groups API by group name.
+    Look up a teacher by id. Returns the teacher dictionary or None.
     """
-    url = "https://es.unitech-mo.ru/api/groups"
-    try:
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an exception for bad status codes
-        data = response.json()
-        
-        # Navigate to the groups list
-        groups = data.get("data", {}).get("groups", [])
-        
-        # Search for the group by name (case-insensitive)
-        for group in groups:
-            if group.get("groupName").lower() == group_name.lower():
-                return group.get("groupID")
-        
-        print(f"Group '{group_name}' not found.")
+    index = await get_teacher_index()
+    if index is None:
         return None
-    except requests.RequestException as e:
+    return index.get(teacher_id)
+
+async def get_group_id(group_name):
+    """
+    Look up groupID by group name in the cached group directory.
+    """
+    try:
+        group_id = await group_directory.get_group_id(group_name)
+        if group_id is None:
+            print(f"Group '{group_name}' not found.")
+        return group_id
+    except httpx.HTTPError as e:
         print(f"Error fetching groups: {e}")
         return None
 
-def get_first_student_id(group_id):
+async def get_first_student_id(group_id):
     """
-    Fetch the first student's studentID for a given groupID.
+    Fetch the first student's studentID for a given groupID (cached per group).
     """
     if not group_id:
         return None
     
-    url = f"https://es.unitech-mo.ru/api/students?groupID={group_id}"
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        
-        # Navigate to the students list
-        students = data.get("data", {}).get("listStudents", [])
-        
-        if students:
-            return students[0].get("studentID")
-        else:
+        student_id = await group_directory.get_student_id(group_id)
+        if student_id is None:
             print(f"No students found for groupID {group_id}.")
-            return None
-    except requests.RequestException as e:
+        return student_id
+    except httpx.HTTPError as e:
         print(f"Error fetching students: {e}")
         return None
 
-def get_schedule(group_name):
+async def resolve_group(group_name):
     """
-    Main function to get the studentID for a given group name.
-    Placeholder for fetching the schedule using the studentID.
+    Resolve a group name to (groupID, studentID of its representative student).
+    Returns None if the group or its students cannot be found.
     """
     # Step 1: Get groupID
-    group_id = get_group_id(group_name)
+    group_id = await get_group_id(group_name)
     if not group_id:
         return None
     
     # Step 2: Get the first student's studentID
-    student_id = get_first_student_id(group_id)
+    student_id = await get_first_student_id(group_id)
     if not student_id:
         return None
     
-    return student_id
\ No newline at end of file
+    return group_id, student_id
+
+async def get_schedule(group_name):
+    """
+    Main function to get the studentID for a given group name.
+    """
+    group = await resolve_group(group_name)
+    return group[1] if group else None
@@ -0,0 +1,132 @@
+# groups.py
+
+import time
+
+from config import GROUPS_CACHE_TTL, GROUP_STUDENT_CACHE_TTL, GROUP_STUDENT_CACHE_MAX_SIZE
+from src import http_client
+from src.cache import TTLCache, SingleFlight
+from src.metrics import cache_seconds, cache_stats
+from src.storage import iter_users, set_group_id
+from src.utils import logger
+
+def normalize_group_name(group_name):
+    """Case-, ё/е- and whitespace-insensitive key for a group name."""
+    return " ".join(group_name.lower().replace('ё', 'е').split())
+
+class GroupDirectory:
+    """
+    In-memory directory of Unitech groups: normalized name -> groupID from
+    /groups, plus a TTL cache of the representative studentID whose schedule
+    is shown for each group. Lookups are dict reads; the network is only hit
+    on the first load, when a name is missing from an expired list, and when
+    a group's studentID is not cached yet.
+    """
+
+    def __init__(self, ttl=GROUPS_CACHE_TTL, student_ttl=GROUP_STUDENT_CACHE_TTL):
+        self.ttl = ttl
+        self.loaded_at = None
+        self._by_name = {}
+        self._flight = SingleFlight()
+        self._students = TTLCache(maxsize=GROUP_STUDENT_CACHE_MAX_SIZE, ttl=student_ttl)
+
+    @property
+    def student_cache(self):
+        """TTL cache of group key -> representative studentID (for cache metrics)."""
+        return self._students
+
+    def is_fresh(self):
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl
+
+    def __len__(self):
+        return len(self._by_name)
+
+    async def refresh(self):
+        """Reload the groups list; concurrent callers share one request."""
+        await self._flight.do("groups", self._load_groups)
+
+    async def _load_groups(self):
+        response = await http_client.get("/groups")
+        response.raise_for_status()
+        groups = response.json().get("data", {}).get("groups", [])
+        self._by_name = {
+            normalize_group_name(group.get("groupName") or ""): group.get("groupID")
+            for group in groups
+        }
+        self.loaded_at = time.monotonic()
+        logger.info("loaded %d groups", len(self._by_name), extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+
+    async def get_group_id(self, group_name):
+        """
+        groupID for a group name, or None if there is no such group.
+        Raises httpx.HTTPError only when the list has never been loaded.
+        """
+        key = normalize_group_name(group_name)
+        if self.loaded_at is None or (key not in self._by_name and not self.is_fresh()):
+            try:
+                await self.refresh()
+            except Exception:
+                if self.loaded_at is None:
+                    raise
+                logger.warning("groups refresh failed, using list from %.0fs ago", time.monotonic() - self.loaded_at, extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+        return self._by_name.get(key)
+
+    async def get_student_id(self, group_id):
+        """
+        Representative studentID for a group (the first student in /students).
+        Falls back to an expired cached value if Unitech is unavailable.
+        """
+        key = str(group_id)
+        with cache_seconds.time(cache="group_students", result="hit") as labels:
+            student_id = self._students.get(key)
+            if student_id is not None:
+                return student_id
+            labels['result'] = "miss"
+            try:
+                student_id = await self._flight.do(("students", key), lambda: self._load_student_id(key))
+            except Exception:
+                stale = self._students.peek(key)
+                if stale is None:
+                    raise
+                labels['result'] = "stale"
+                return stale
+            return student_id
+
+    async def _load_student_id(self, key):
+        response = await http_client.get("/students", params={'groupID': key})
+        response.raise_for_status()
+        students = response.json().get("data", {}).get("listStudents", [])
+        student_id = students[0].get("studentID") if students else None
+        if student_id is not None:
+            self._students.set(key, student_id)
+        return student_id
+
+group_directory = GroupDirectory()
+cache_stats.register("group_students", group_directory.student_cache)
+
+async def refresh_groups(context=None):
+    """JobQueue callback: keep the groups list fresh so /change needs no request."""
+    try:
+        await group_directory.refresh()
+    except Exception as e:
+        logger.warning("failed to refresh groups list: %s", str(e), extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+
+async def migrate_group_keys(context=None):
+    """
+    One-off JobQueue callback: attach group_id to chats saved before it was
+    recorded (only id_student and group_name), so they share the group's
+    schedule key. Chats whose group cannot be resolved keep their id_student.
+    """
+    migrated = 0
+    for chat_id, user_data in await iter_users():
+        if "group_id" in user_data or "id_teacher" in user_data or not user_data.get("group_name"):
+            continue
+        try:
+            group_id = await group_directory.get_group_id(user_data["group_name"])
+        except Exception as e:
+            logger.warning("group key migration stopped: %s", str(e), extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+            break
+        if group_id is not None:
+            await set_group_id(chat_id, group_id)
+            migrated += 1
+    if migrated:
+        logger.info("migrated %d chats to group schedule keys", migrated, extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
@@ -5,24 +5,24 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes, ConversationHandler
+from telegram.constants import ChatType
+from telegram.ext import ContextTypes, ConversationHandler, filters
+from telegram.error import BadRequest
 from datetime import datetime
 import traceback
 
 from config import BOT_VERSION, LAST_UPDATED, FEEDBACK_WAITING, DAY_SELECTION, TEACHER_SELECT_WAITING, STUDENT_GROUP_WAITING
-from src.utils import load_users, save_users, MSK, logger
+from src.utils import MSK, logger, split_message
+from src.storage import get_user, create_user, set_student, set_teacher
 from src.keyboards import get_menu_keyboard, get_schedule_keyboard, get_day_selection_keyboard, get_change_group_keyboard
-from src.schedule import download_ics, download_teacher_ics, parse_ics, get_today_schedule, get_tomorrow_schedule, get_week_schedule, get_next_week_schedule, get_day_schedule
-from src.get_student_id import get_schedule, find_teacher
+from src.schedule import get_schedule_key, fetch_schedule, render_schedule, DAY_SEPARATOR
+from src.get_student_id import resolve_group, find_teacher, get_teacher
 
-from config import CHANGE_GROUP_WAITING, DEVELOPER_CHAT_ID, DEVELOPER_USERNAME
+from config import CHANGE_GROUP_WAITING, DEVELOPER_CHAT_ID, DEVELOPER_USERNAME, TEACHER_SEARCH_LIMIT
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_key = f"{update.effective_chat.id}"
-    users_data = load_users()
-    if chat_key not in users_data:
-        users_data[chat_key] = {'id_student': 90893}
-        save_users(users_data)
+    await create_user(chat_key, {'id_student': 90893})
     await update.message.reply_text(
         'Привет! 👋 Я бот, который поможет тебе узнать расписание занятий Технологического Университета им. А.А. Леонова с портала Unitech!\n'
         'По умолчанию показываю расписание для группы ПИ-23. Хочешь другую? Используй /change <название группы> (например, /change ПИ-23).\n'
@@ -59,7 +59,6 @@ async def info(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def change_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_key = f"{update.effective_chat.id}"
-    users_data = load_users()
     if len(context.args) < 1:
         await update.message.reply_text(
             "Использование: /change <название группы> (например, /change ПИ-23)"
@@ -73,8 +72,8 @@ async def change_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     group_name = ' '.join(context.args)
     try:
-        student_id = get_schedule(group_name)
-        if not student_id:
+        group = await resolve_group(group_name)
+        if not group:
             await update.message.reply_text(
                 f"Не удалось найти группу '{group_name}' или студентов в ней. Проверьте название и попробуйте снова.",
                 reply_markup=get_menu_keyboard()
@@ -100,15 +99,13 @@ async def change_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    users_data[chat_key] = users_data.get(chat_key, {})
-    users_data[chat_key]["id_student"] = student_id
-    users_data[chat_key]["group_name"] = group_name
-    save_users(users_data)
+    group_id, student_id = group
+    await set_student(chat_key, student_id, group_name, group_id)
     await update.message.reply_text(
         f"Группа изменена на {group_name} (ID студента: {student_id})",
         reply_markup=get_menu_keyboard()
     )
-    logger.info("changed group to %s (student ID: %s)", group_name, student_id, extra={
+    logger.info("changed group to %s (group ID: %s, student ID: %s)", group_name, group_id, student_id, extra={
         'user_id': update.effective_user.id,
         'chat_id': update.effective_chat.id,
         'username': update.effective_user.username or 'unknown'
@@ -321,32 +318,36 @@ async def day_selection_text(update: Update, context: ContextTypes.DEFAULT_TYPE)
         })
         return DAY_SELECTION
 
-def get_schedule_events(chat_key):
-    """Helper function to get events based on user type (student or teacher)"""
-    users_data = load_users()
-    user_data = users_data.get(chat_key, {})
+async def get_schedule_events(chat_key):
+    """Helper function to get the cached schedule based on user type (student or teacher)"""
+    user_data = await get_user(chat_key)
     
-    # Check if teacher mode is enabled
-    if "id_teacher" in user_data:
-        teacher_id = user_data["id_teacher"]
-        ics_content = download_teacher_ics(teacher_id)
-    else:
-        student_id = user_data.get('id_student', 90893)
-        ics_content = download_ics(student_id)
-    
-    events = parse_ics(ics_content)
-    return events, user_data
+    kind, schedule_id = get_schedule_key(user_data)
+    cached = await fetch_schedule(kind, schedule_id)
+    return cached, user_data
+
+def split_schedule(text):
+    """Split a schedule text on day boundaries into parts that fit one Telegram message."""
+    return split_message(text, "\n" + DAY_SEPARATOR)
+
+async def reply_schedule(message, text, reply_markup=None):
+    """Reply with a schedule in as few messages as fit; the keyboard goes on the last one."""
+    *parts, last = split_schedule(text)
+    for part in parts:
+        await message.reply_text(part)
+    return await message.reply_text(last, reply_markup=reply_markup)
 
 async def today_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_key = f"{update.effective_chat.id}"
     
     try:
-        events, user_data = get_schedule_events(chat_key)
-        schedule, _ = get_today_schedule(events)
+        cached, user_data = await get_schedule_events(chat_key)
+        schedule, _ = render_schedule(cached, "today")
         
         user_type = "преподавателя" if "id_teacher" in user_data else "сегодня"
-        await update.message.reply_text(
-            f"Расписание для {user_type}:\n{schedule}",
+        await reply_schedule(
+            update.message,
+            f"Расписание для {user_type}:\n{schedule}{cached.stale_note()}",
             reply_markup=get_schedule_keyboard(exclude="today")
         )
         logger.info("sent today's schedule", extra={
@@ -374,12 +375,13 @@ async def tomorrow_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_key = f"{update.effective_chat.id}"
     
     try:
-        events, user_data = get_schedule_events(chat_key)
-        schedule, _ = get_tomorrow_schedule(events)
+        cached, user_data = await get_schedule_events(chat_key)
+        schedule, _ = render_schedule(cached, "tomorrow")
         
         user_type = "преподавателя" if "id_teacher" in user_data else "завтра"
-        await update.message.reply_text(
-            f"Расписание на {user_type}:\n{schedule}",
+        await reply_schedule(
+            update.message,
+            f"Расписание на {user_type}:\n{schedule}{cached.stale_note()}",
             reply_markup=get_schedule_keyboard(exclude="tomorrow")
         )
         logger.info("sent tomorrow's schedule", extra={
@@ -407,10 +409,11 @@ async def week_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_key = f"{update.effective_chat.id}"
     
     try:
-        events, user_data = get_schedule_events(chat_key)
-        schedule, _ = get_week_schedule(events)
-        await update.message.reply_text(
-            f"Расписание на неделю:\n{schedule}",
+        cached, user_data = await get_schedule_events(chat_key)
+        schedule, _ = render_schedule(cached, "week")
+        await reply_schedule(
+            update.message,
+            f"Расписание на неделю:\n{schedule}{cached.stale_note()}",
             reply_markup=get_schedule_keyboard(exclude="week")
         )
         logger.info("sent week's schedule", extra={
@@ -438,10 +441,11 @@ async def next_week_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_key = f"{update.effective_chat.id}"
     
     try:
-        events, user_data = get_schedule_events(chat_key)
-        schedule, _ = get_next_week_schedule(events)
-        await update.message.reply_text(
-            f"Расписание на следующую неделю:\n{schedule}",
+        cached, user_data = await get_schedule_events(chat_key)
+        schedule, _ = render_schedule(cached, "next_week")
+        await reply_schedule(
+            update.message,
+            f"Расписание на следующую неделю:\n{schedule}{cached.stale_note()}",
             reply_markup=get_schedule_keyboard(exclude="next_week")
         )
         logger.info("sent next week's schedule", extra={
@@ -494,17 +498,17 @@ async def day_command(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_i
     
     try:
         day = int(context.args[0])
-        events, user_data = get_schedule_events(chat_key)
-        schedule, _ = get_day_schedule(events, day)
+        cached, user_data = await get_schedule_events(chat_key)
+        schedule, _ = render_schedule(cached, "day", day)
         try:
             await (update.message or update.callback_query.message).reply_text(
-                f"Расписание на {day} число:\n{schedule}",
+                f"Расписание на {day} число:\n{schedule}{cached.stale_note()}",
                 reply_markup=get_schedule_keyboard(exclude="day")
             )
         except Exception as e:
             await context.bot.send_message(
                 chat_id=chat_id,
-                text=f"Расписание на {day} число:\n{schedule}",
+                text=f"Расписание на {day} число:\n{schedule}{cached.stale_note()}",
                 reply_markup=get_schedule_keyboard(exclude="day")
             )
             logger.warning("failed to reply in day_command, sent new message: %s", str(e), extra={
@@ -568,39 +572,61 @@ async def day_command(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_i
         })
 
 async def send_message(query, context, text, reply_markup=None):
-    try:
-        await query.message.reply_text(text, reply_markup=reply_markup)
-    except Exception as e:
-        logger.warning("failed to reply to message: %s, sending new message", str(e), extra={
-            'user_id': query.from_user.id,
-            'chat_id': query.message.chat_id,
-            'username': query.from_user.username or 'unknown'
-        })
-        await context.bot.send_message(
-            chat_id=query.message.chat_id,
-            text=text,
-            reply_markup=reply_markup
-        )
+    # Long week schedules go out as several messages split on day boundaries
+    await _send_parts(query, context, split_schedule(text), reply_markup)
+
+async def _send_parts(query, context, parts, reply_markup=None):
+    *parts, last = parts
+    for part, markup in [(part, None) for part in parts] + [(last, reply_markup)]:
+        try:
+            await query.message.reply_text(part, reply_markup=markup)
+        except Exception as e:
+            logger.warning("failed to reply to message: %s, sending new message", str(e), extra={
+                'user_id': query.from_user.id,
+                'chat_id': query.message.chat_id,
+                'username': query.from_user.username or 'unknown'
+            })
+            await context.bot.send_message(
+                chat_id=query.message.chat_id,
+                text=part,
+                reply_markup=markup
+            )
+
+async def edit_message(query, context, text, reply_markup=None):
+    """
+    Show `text` in the message whose button was pressed instead of sending a
+    new one. No request is made when the message already has the same text and
+    keyboard. A schedule too long for one message continues in new messages.
+    If the message cannot be edited, the text is sent as a new message.
+    """
+    first, *rest = split_schedule(text)
+    markup = None if rest else reply_markup
+    message = query.message
+    # Telegram trims surrounding whitespace of the stored text
+    if message.text != first.strip() or message.reply_markup != markup:
+        try:
+            await message.edit_text(first, reply_markup=markup)
+        except BadRequest as e:
+            if "message is not modified" not in str(e).lower():
+                logger.warning("failed to edit message: %s, sending new message", str(e), extra={
+                    'user_id': query.from_user.id,
+                    'chat_id': message.chat_id,
+                    'username': query.from_user.username or 'unknown'
+                })
+                await send_message(query, context, text, reply_markup)
+                return
+    if rest:
+        await _send_parts(query, context, rest, reply_markup)
 
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    
-    try:
-        if query.message:
-            await query.message.delete()
-    except Exception as e:
-        logger.warning("failed to delete message in handle_callback: %s", str(e), extra={
-            'user_id': update.effective_user.id,
-            'chat_id': update.effective_chat.id,
-            'username': update.effective_user.username or 'unknown'
-        })
 
     if query.data == "menu":
         try:
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="Возвращаемся в главное меню.",
+            await edit_message(
+                query, context,
+                "Возвращаемся в главное меню.",
                 reply_markup=get_menu_keyboard()
             )
         except Exception as e:
@@ -630,14 +656,14 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_key = f"{update.effective_chat.id}"
     
     try:
-        events, user_data = get_schedule_events(chat_key)
+        cached, user_data = await get_schedule_events(chat_key)
         
         if query.data == "today":
-            schedule, _ = get_today_schedule(events)
+            schedule, _ = render_schedule(cached, "today")
             user_type = "преподавателя" if "id_teacher" in user_data else "сегодня"
-            await send_message(
+            await edit_message(
                 query, context,
-                f"Расписание для {user_type}:\n{schedule}",
+                f"Расписание для {user_type}:\n{schedule}{cached.stale_note()}",
                 reply_markup=get_schedule_keyboard(exclude="today")
             )
             logger.info("sent today's schedule via callback", extra={
@@ -646,11 +672,11 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 'username': update.effective_user.username or 'unknown'
             })
         elif query.data == "tomorrow":
-            schedule, _ = get_tomorrow_schedule(events)
+            schedule, _ = render_schedule(cached, "tomorrow")
             user_type = "преподавателя" if "id_teacher" in user_data else "завтра"
-            await send_message(
+            await edit_message(
                 query, context,
-                f"Расписание на {user_type}:\n{schedule}",
+                f"Расписание на {user_type}:\n{schedule}{cached.stale_note()}",
                 reply_markup=get_schedule_keyboard(exclude="tomorrow")
             )
             logger.info("sent tomorrow's schedule via callback", extra={
@@ -659,10 +685,10 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 'username': update.effective_user.username or 'unknown'
             })
         elif query.data == "week":
-            schedule, _ = get_week_schedule(events)
-            await send_message(
+            schedule, _ = render_schedule(cached, "week")
+            await edit_message(
                 query, context,
-                f"Расписание на неделю:\n{schedule}",
+                f"Расписание на неделю:\n{schedule}{cached.stale_note()}",
                 reply_markup=get_schedule_keyboard(exclude="week")
             )
             logger.info("sent week's schedule via callback", extra={
@@ -671,10 +697,10 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 'username': update.effective_user.username or 'unknown'
             })
         elif query.data == "next_week":
-            schedule, _ = get_next_week_schedule(events)
-            await send_message(
+            schedule, _ = render_schedule(cached, "next_week")
+            await edit_message(
                 query, context,
-                f"Расписание на следующую неделю:\n{schedule}",
+                f"Расписание на следующую неделю:\n{schedule}{cached.stale_note()}",
                 reply_markup=get_schedule_keyboard(exclude="next_week")
             )
             logger.info("sent next week's schedule via callback", extra={
@@ -695,7 +721,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             error_message = "Сервер Unitech временно недоступен (ошибка 504). Пожалуйста, попробуйте снова через несколько минут."
         elif "Read timeout" in str(e):
             error_message = "Не удалось подключиться к серверу Unitech из-за таймаута. Проверьте интернет-соединение и попробуйте снова."
-        await send_message(
+        await edit_message(
             query, context,
             error_message,
             reply_markup=get_schedule_keyboard(show_menu_button=True)
@@ -736,11 +762,10 @@ async def change_receive(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle student group name input"""
     group_name = update.message.text.strip()
     chat_key = f"{update.effective_chat.id}"
-    users_data = load_users()
     
     try:
-        student_id = get_schedule(group_name)
-        if not student_id:
+        group = await resolve_group(group_name)
+        if not group:
             await update.message.reply_text(
                 f"Не удалось найти группу '{group_name}' или студентов в ней. Проверьте название и попробуйте снова.",
                 reply_markup=get_menu_keyboard()
@@ -752,20 +777,14 @@ async def change_receive(update: Update, context: ContextTypes.DEFAULT_TYPE):
             })
             return ConversationHandler.END
         
-        users_data[chat_key] = users_data.get(chat_key, {})
-        users_data[chat_key]["id_student"] = student_id
-        users_data[chat_key]["group_name"] = group_name
-        # Clear teacher data when switching to student mode
-        if "id_teacher" in users_data[chat_key]:
-            del users_data[chat_key]["id_teacher"]
-        if "teacher_name" in users_data[chat_key]:
-            del users_data[chat_key]["teacher_name"]
-        save_users(users_data)
+        # Clears teacher data when switching to student mode
+        group_id, student_id = group
+        await set_student(chat_key, student_id, group_name, group_id)
         await update.message.reply_text(
             f"Группа изменена на {group_name} (ID студента: {student_id})",
             reply_markup=get_menu_keyboard()
         )
-        logger.info("changed group to %s (student ID: %s)", group_name, student_id, extra={
+        logger.info("changed group to %s (group ID: %s, student ID: %s)", group_name, group_id, student_id, extra={
             'user_id': update.effective_user.id,
             'chat_id': update.effective_chat.id,
             'username': update.effective_user.username or 'unknown'
@@ -841,10 +860,9 @@ async def change_teacher_receive(update: Update, context: ContextTypes.DEFAULT_T
     """Handle teacher name input and search for teachers"""
     teacher_name = update.message.text.strip()
     chat_key = f"{update.effective_chat.id}"
-    users_data = load_users()
     
     try:
-        teachers = find_teacher(teacher_name)
+        teachers = await find_teacher(teacher_name, limit=TEACHER_SEARCH_LIMIT)
         
         if not teachers:
             await update.message.reply_text(
@@ -860,7 +878,7 @@ async def change_teacher_receive(update: Update, context: ContextTypes.DEFAULT_T
         
         if len(teachers) > 1:
             keyboard = []
-            for teacher in teachers[:10]:
+            for teacher in teachers:
                 keyboard.append([InlineKeyboardButton(teacher['name'], callback_data=f"teacher_select_{teacher['id']}")])
             keyboard.append([InlineKeyboardButton("Отмена", callback_data="menu")])
             
@@ -879,14 +897,7 @@ async def change_teacher_receive(update: Update, context: ContextTypes.DEFAULT_T
         teacher_id = teacher['id']
         teacher_name_full = teacher['name']
         
-        users_data[chat_key] = users_data.get(chat_key, {})
-        users_data[chat_key]["id_teacher"] = teacher_id
-        users_data[chat_key]["teacher_name"] = teacher_name_full
-        if "id_student" in users_data[chat_key]:
-            del users_data[chat_key]["id_student"]
-        if "group_name" in users_data[chat_key]:
-            del users_data[chat_key]["group_name"]
-        save_users(users_data)
+        await set_teacher(chat_key, teacher_id, teacher_name_full)
         
         await update.message.reply_text(
             f"Выбран преподаватель: {teacher_name_full} (ID: {teacher_id})",
@@ -922,23 +933,11 @@ async def teacher_select_receive(update: Update, context: ContextTypes.DEFAULT_T
     if query.data.startswith("teacher_select_"):
         teacher_id = int(query.data.split("_")[-1])
         chat_key = f"{update.effective_chat.id}"
-        users_data = load_users()
         
-        teachers = find_teacher("")
-        teacher_name = ""
-        for t in teachers:
-            if t['id'] == teacher_id:
-                teacher_name = t['name']
-                break
+        teacher = await get_teacher(teacher_id)
+        teacher_name = teacher['name'] if teacher else ""
         
-        users_data[chat_key] = users_data.get(chat_key, {})
-        users_data[chat_key]["id_teacher"] = teacher_id
-        users_data[chat_key]["teacher_name"] = teacher_name
-        if "id_student" in users_data[chat_key]:
-            del users_data[chat_key]["id_student"]
-        if "group_name" in users_data[chat_key]:
-            del users_data[chat_key]["group_name"]
-        save_users(users_data)
+        await set_teacher(chat_key, teacher_id, teacher_name)
         
         try:
             await query.message.edit_text(
@@ -962,13 +961,39 @@ async def teacher_select_receive(update: Update, context: ContextTypes.DEFAULT_T
     
     return TEACHER_SELECT_WAITING
 
+def _strip_mention(text, bot_username):
+    """Text without a leading "@botname" / "botname", or None if it does not start with one."""
+    for mention in (f"@{bot_username}", bot_username):
+        if text[:len(mention)].lower() == mention.lower():
+            return text[len(mention):].strip()
+    return None
+
+class AddressedToBot(filters.MessageFilter):
+    """
+    Lets through private messages and group messages that start with the bot's
+    username or reply to the bot; other group chatter never reaches a handler.
+    The bot identity comes from the Bot object (fetched once by
+    Application.initialize), so filtering makes no API calls.
+    """
+
+    def filter(self, message):
+        if message.chat.type not in (ChatType.GROUP, ChatType.SUPERGROUP):
+            return True
+        bot = message.get_bot()
+        reply = message.reply_to_message
+        if reply and reply.from_user and reply.from_user.id == bot.id:
+            return True
+        return bool(message.text) and _strip_mention(message.text.strip(), bot.username) is not None
+
+addressed_to_bot = AddressedToBot()
+
 async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Group messages not addressed to the bot are dropped by the addressed_to_bot filter
     text = update.message.text.strip()
-    if update.effective_chat.type in ['group', 'supergroup']:
-        bot_username = (await context.bot.get_me()).username
-        if not (text.startswith(bot_username) or (update.message.reply_to_message and update.message.reply_to_message.from_user.id == context.bot.id)):
-            return
-        text = text.replace(bot_username, '').strip()
+    if update.effective_chat.type in [ChatType.GROUP, ChatType.SUPERGROUP]:
+        stripped = _strip_mention(text, context.bot.username)
+        if stripped is not None:
+            text = stripped
     
     if text in ["Расп. на сегодня", "Расписание на сегодня"]:
         await today_command(update, context)
@@ -0,0 +1,62 @@
+# http_client.py
+
+import asyncio
+from urllib.parse import urlparse
+
+import httpx
+
+from config import (
+    UNITECH_API_URL, HTTP_TIMEOUT, HTTP_CONNECT_TIMEOUT, HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS, HTTP_MAX_CONCURRENCY
+)
+from src.metrics import upstream_seconds
+
+# Path of the API root ("/api"), so metrics name endpoints as "/api/Rasp"
+_API_PATH = urlparse(UNITECH_API_URL).path.rstrip('/')
+
+_client = None
+_semaphore = None
+
+def get_client():
+    """
+    Return the shared AsyncClient with a pooled keep-alive connection set.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=UNITECH_API_URL,
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS
+            )
+        )
+    return _client
+
+def _get_semaphore():
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(HTTP_MAX_CONCURRENCY)
+    return _semaphore
+
+async def get(path, params=None, headers=None, timeout=HTTP_TIMEOUT):
+    """
+    GET a Unitech API path. At most HTTP_MAX_CONCURRENCY requests run at once,
+    the rest wait for a free slot without blocking the event loop.
+    Request time (without the wait) goes to unitech_upstream_request_duration_seconds.
+    """
+    async with _get_semaphore():
+        with upstream_seconds.time(endpoint=_API_PATH + path, status="error") as labels:
+            response = await get_client().get(
+                path, params=params, headers=headers,
+                timeout=httpx.Timeout(timeout, connect=min(timeout, HTTP_CONNECT_TIMEOUT))
+            )
+            labels['status'] = response.status_code
+        return response
+
+async def close_client(application=None):
+    """Close pooled connections. Usable as Application.post_shutdown callback."""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
@@ -7,19 +7,33 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from datetime import datetime
 import calendar
+import functools
 from src.utils import MSK
 
+DAYS_PER_PAGE = 10
+
+# Keyboards are immutable, so one instance is shared by every reply.
+# Day selection pages depend on the month and are rebuilt when it changes.
+_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Расп. на сегодня", callback_data="today"),
+     InlineKeyboardButton("Расп. на завтра", callback_data="tomorrow")],
+    [InlineKeyboardButton("Расп. на неделю", callback_data="week"),
+     InlineKeyboardButton("Расп. на след. неделю", callback_data="next_week")],
+    [InlineKeyboardButton("Расп. на день", callback_data="day"),
+     InlineKeyboardButton("Изменить расп.", callback_data="change")],
+    [InlineKeyboardButton("Обратная связь", callback_data="feedback")]
+])
+_CHANGE_GROUP_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Я студент", callback_data="change_student")],
+    [InlineKeyboardButton("Я преподаватель", callback_data="change_teacher")]
+])
+_day_keyboards = {}
+_day_keyboards_month = None
+
 def get_menu_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("Расп. на сегодня", callback_data="today"),
-         InlineKeyboardButton("Расп. на завтра", callback_data="tomorrow")],
-        [InlineKeyboardButton("Расп. на неделю", callback_data="week"),
-         InlineKeyboardButton("Расп. на след. неделю", callback_data="next_week")],
-        [InlineKeyboardButton("Расп. на день", callback_data="day"),
-         InlineKeyboardButton("Изменить расп.", callback_data="change")],
-        [InlineKeyboardButton("Обратная связь", callback_data="feedback")]
-    ])
+    return _MENU_KEYBOARD
 
+@functools.lru_cache(maxsize=None)
 def get_schedule_keyboard(exclude=None, show_menu_button=True):
     buttons = []
     if exclude != "today":
@@ -52,18 +66,27 @@ def get_change_group_keyboard():
     """
     Keyboard for choosing between student group or teacher mode.
     """
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("Я студент", callback_data="change_student")],
-        [InlineKeyboardButton("Я преподаватель", callback_data="change_teacher")]
-    ])
+    return _CHANGE_GROUP_KEYBOARD
 
 def get_day_selection_keyboard(page=0):
+    global _day_keyboards_month
     today = datetime.now(MSK)
-    year, month = today.year, today.month
+    month = (today.year, today.month)
+    if month != _day_keyboards_month:
+        _day_keyboards.clear()
+        _day_keyboards_month = month
+    keyboard = _day_keyboards.get(page)
+    if keyboard is None:
+        keyboard = _build_day_selection_keyboard(today.year, today.month, page)
+        # Pages come from callback data; only real pages of the month are kept
+        if 0 <= page * DAYS_PER_PAGE < calendar.monthrange(today.year, today.month)[1]:
+            _day_keyboards[page] = keyboard
+    return keyboard
+
+def _build_day_selection_keyboard(year, month, page):
     _, max_days = calendar.monthrange(year, month)
-    days_per_page = 10
-    start_day = page * days_per_page + 1
-    end_day = min(start_day + days_per_page - 1, max_days)
+    start_day = page * DAYS_PER_PAGE + 1
+    end_day = min(start_day + DAYS_PER_PAGE - 1, max_days)
     
     keyboard = []
     row = []
@@ -84,4 +107,4 @@ def get_day_selection_keyboard(page=0):
         keyboard.append(nav_row)
     
     keyboard.append([InlineKeyboardButton("Вернуться в меню", callback_data="menu")])
-    return InlineKeyboardMarkup(keyboard)
\ No newline at end of file
+    return InlineKeyboardMarkup(keyboard)
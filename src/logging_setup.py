@@ -2,6 +2,7 @@
 
 import logging
 import logging.handlers
+import multiprocessing
 import os
 
 from config import LOGS_DIR
@@ -20,13 +21,16 @@ def setup_logging():
     if not os.path.exists(LOGS_DIR):
         os.makedirs(LOGS_DIR)
     
-    log_base = os.path.join(LOGS_DIR, "log")
-    file_handler = logging.handlers.TimedRotatingFileHandler(
-        log_base, when="midnight", interval=1, backupCount=30, encoding='utf-8'
-    )
-    file_handler.suffix = "%Y-%m-%d"
-    file_handler.setFormatter(CustomFormatter('%(asctime)s - User %(user_id)s (%(username)s) in chat %(chat_id)s: %(message)s'))
-    logger.addHandler(file_handler)
+    # Schedule pool workers (SCHEDULE_POOL=process) re-import the bot modules; only the
+    # bot process writes and rotates Logs/log, workers log to stderr
+    if multiprocessing.current_process().name == "MainProcess":
+        log_base = os.path.join(LOGS_DIR, "log")
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            log_base, when="midnight", interval=1, backupCount=30, encoding='utf-8'
+        )
+        file_handler.suffix = "%Y-%m-%d"
+        file_handler.setFormatter(CustomFormatter('%(asctime)s - User %(user_id)s (%(username)s) in chat %(chat_id)s: %(message)s'))
+        logger.addHandler(file_handler)
     
     stream_handler = logging.StreamHandler()
     stream_handler.setFormatter(CustomFormatter('%(asctime)s - User %(user_id)s (%(username)s) in chat %(chat_id)s: %(message)s'))
@@ -0,0 +1,176 @@
+# metrics.py
+
+import asyncio
+import functools
+import time
+from contextlib import contextmanager
+
+from telegram.request import HTTPXRequest
+
+from config import METRICS_PORT, METRICS_LISTEN, METRICS_READ_TIMEOUT
+from src.utils import logger
+
+# Upper bounds in seconds: from cache hits and renders (sub-millisecond) to Unitech timeouts
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_metrics = []
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(pairs):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}" if pairs else ""
+
+class Histogram:
+    """
+    Prometheus histogram with labels: per label set, a count per bucket, the
+    sum and the number of observations. Only the event loop thread observes,
+    so no locking.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+        counts = series[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a with-block; `labels` may be changed inside it (e.g. the result)."""
+        start = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self._series.items()):
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', repr(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(pairs)} {total!r}")
+            lines.append(f"{self.name}_count{_format_labels(pairs)} {count}")
+        return lines
+
+class CacheStats:
+    """Hit/miss counters and size of registered TTLCache instances, read at scrape time."""
+
+    def __init__(self):
+        self._caches = {}
+        _metrics.append(self)
+
+    def register(self, name, cache):
+        self._caches[name] = cache
+
+    def collect(self):
+        lines = []
+        for metric, kind, field, documentation in (
+            ("unitech_cache_hits_total", "counter", 'hits', "Cache lookups that found a live entry."),
+            ("unitech_cache_misses_total", "counter", 'misses', "Cache lookups that found nothing or an expired entry."),
+            ("unitech_cache_entries", "gauge", 'size', "Entries currently held, expired ones included."),
+        ):
+            lines += [f"# HELP {metric} {documentation}", f"# TYPE {metric} {kind}"]
+            for name, cache in sorted(self._caches.items()):
+                lines.append(f"{metric}{_format_labels([('cache', name)])} {cache.stats()[field]}")
+        return lines
+
+handler_seconds = Histogram(
+    "unitech_handler_duration_seconds", "Time to process an update, per handler callback.", ("handler",))
+upstream_seconds = Histogram(
+    "unitech_upstream_request_duration_seconds", "Unitech API requests, per endpoint and HTTP status.", ("endpoint", "status"))
+telegram_seconds = Histogram(
+    "unitech_telegram_request_duration_seconds", "Telegram Bot API requests made by handlers, per method.", ("method",))
+stage_seconds = Histogram(
+    "unitech_schedule_stage_duration_seconds", "Schedule processing outside the network: ICS parse and text render.", ("stage",))
+cache_seconds = Histogram(
+    "unitech_cache_lookup_duration_seconds", "Time to get a value through a cache, including the load on a miss.", ("cache", "result"))
+cache_stats = CacheStats()
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines += metric.collect()
+    return "\n".join(lines) + "\n"
+
+def instrument_handler(callback):
+    """
+    Wrap a python-telegram-bot callback where it is registered: duration goes
+    to unitech_handler_duration_seconds. Handlers that call each other
+    (handle_callback -> today_command) call the plain functions, so an update
+    is timed once.
+    """
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        with handler_seconds.time(handler=callback.__name__):
+            return await callback(*args, **kwargs)
+    return wrapper
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that times every Bot API call (sendMessage, editMessageText ...)."""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        with telegram_seconds.time(method=url.rsplit('/', 1)[-1]):
+            return await super().do_request(url, method, *args, **kwargs)
+
+async def _read_request_line(reader):
+    request_line = await reader.readline()
+    # Skip headers up to the blank line
+    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+        pass
+    return request_line
+
+async def _serve(reader, writer):
+    try:
+        # A client that never finishes its request must not hold the connection open
+        request_line = await asyncio.wait_for(_read_request_line(reader), METRICS_READ_TIMEOUT)
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split('?', 1)[0] == "/metrics":
+            status, body = "200 OK", render().encode('utf-8')
+        else:
+            status, body = "404 Not Found", b"Not Found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+_server = None
+
+async def start_metrics_server(application=None):
+    """Serve GET /metrics on METRICS_LISTEN:METRICS_PORT (0 disables). Usable as Application.post_init callback."""
+    global _server
+    if not METRICS_PORT or _server is not None:
+        return
+    _server = await asyncio.start_server(_serve, METRICS_LISTEN, METRICS_PORT)
+    logger.info("metrics on http://%s:%d/metrics", METRICS_LISTEN, METRICS_PORT, extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+
+async def stop_metrics_server(application=None):
+    global _server
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
@@ -0,0 +1,229 @@
+# persistence.py
+
+import asyncio
+import json
+import os
+import pickle
+
+from telegram import Update
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput, PicklePersistence
+
+from config import CONVERSATIONS_FILE, CONVERSATION_STATE_TTL, PERSISTENCE_UPDATE_INTERVAL
+from src.backends import get_backend
+
+class BackendPersistence(BasePersistence):
+    """
+    python-telegram-bot persistence over the state backend (src/backends.py).
+    Each conversation entry, user_data, chat_data and bot_data is its own
+    pickled key, so a write touches only what changed. user_data, chat_data
+    and bot_data are written by Application every `update_interval` seconds.
+    Conversation states are not preloaded or written periodically: a
+    SharedConversationHandler reads the state of each update from the
+    backend and writes it back as soon as it changes.
+    """
+
+    def __init__(self, backend, update_interval=PERSISTENCE_UPDATE_INTERVAL):
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self._backend = backend
+
+    async def _get(self, key):
+        data = await asyncio.to_thread(self._backend.get, key)
+        return pickle.loads(data) if data else None
+
+    async def _set(self, key, value, ttl=None):
+        await asyncio.to_thread(self._backend.set, key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ttl)
+
+    async def _delete(self, key):
+        await asyncio.to_thread(self._backend.delete, key)
+
+    async def _load_prefix(self, prefix):
+        """{key suffix: value} for every key under prefix."""
+        keys = await asyncio.to_thread(self._backend.scan, prefix)
+        values = await asyncio.to_thread(self._backend.mget, keys)
+        return {key[len(prefix):]: pickle.loads(value) for key, value in zip(keys, values) if value}
+
+    async def get_user_data(self):
+        return {int(user_id): data for user_id, data in (await self._load_prefix("user_data:")).items()}
+
+    async def get_chat_data(self):
+        return {int(chat_id): data for chat_id, data in (await self._load_prefix("chat_data:")).items()}
+
+    async def get_bot_data(self):
+        return await self._get("bot_data") or {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        # Nothing to preload: load_conversation_states fetches the state of each update's key when it arrives
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        # Written right away by SharedConversationHandler; this periodic write of the
+        # local copy could overwrite a newer state saved by another worker meanwhile
+        pass
+
+    @staticmethod
+    def _conversation_key(name, key):
+        # Conversation keys are tuples of chat/user ids, stored as JSON lists in the key
+        return f"conversation:{name}:{json.dumps(list(key))}"
+
+    async def load_conversations(self, entries):
+        """Current states for a list of (handler name, conversation key); None where there is no conversation."""
+        values = await asyncio.to_thread(self._backend.mget, [self._conversation_key(name, key) for name, key in entries])
+        return [pickle.loads(value) if value else None for value in values]
+
+    async def save_conversation(self, name, key, new_state):
+        backend_key = self._conversation_key(name, key)
+        if new_state is None:
+            await self._delete(backend_key)
+        else:
+            # Abandoned flows expire instead of piling up
+            await self._set(backend_key, new_state, CONVERSATION_STATE_TTL)
+
+    async def update_user_data(self, user_id, data):
+        await self._set(f"user_data:{user_id}", data)
+
+    async def update_chat_data(self, chat_id, data):
+        await self._set(f"chat_data:{chat_id}", data)
+
+    async def update_bot_data(self, data):
+        await self._set("bot_data", data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        await self._delete(f"chat_data:{chat_id}")
+
+    async def drop_user_data(self, user_id):
+        await self._delete(f"user_data:{user_id}")
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        # Every update_* call is already written to the backend
+        pass
+
+class SharedConversationHandler(ConversationHandler):
+    """
+    ConversationHandler whose states live in BackendPersistence rather than
+    in this worker's memory: load_conversation_states refreshes the state of
+    an update's key before the update is matched, and a state changed by a
+    callback is saved at once, so the next message of a flow ("enter your
+    group") may be handled by any worker. With LocalPersistence it behaves
+    exactly like ConversationHandler.
+    """
+
+    def conversation_key(self, update):
+        """Key of the conversation an update belongs to, or None if this handler cannot track it."""
+        try:
+            return self._get_key(update)
+        except (RuntimeError, AttributeError):
+            return None
+
+    def set_loaded_state(self, key, state):
+        # Bypass write tracking: a state just read from the backend must not be written back by Application
+        if state is None:
+            self._conversations.data.pop(key, None)
+        else:
+            self._conversations.update_no_track({key: state})
+
+    async def handle_update(self, update, application, check_result, context):
+        persistence = application.persistence
+        if not isinstance(persistence, BackendPersistence):
+            return await super().handle_update(update, application, check_result, context)
+        key = self._get_key(update)
+        old_state = self._conversations.get(key)
+        result = await super().handle_update(update, application, check_result, context)
+        new_state = self._conversations.get(key)
+        if new_state != old_state:
+            await persistence.save_conversation(self.name, key, new_state)
+        return result
+
+async def load_conversation_states(update, context):
+    """
+    TypeHandler callback in group -1, i.e. before any ConversationHandler
+    checks the update: load the current states of this update's
+    conversations from the shared backend into every SharedConversationHandler.
+    """
+    persistence = context.application.persistence
+    if not isinstance(persistence, BackendPersistence) or not isinstance(update, Update):
+        return
+    entries = []
+    for handlers in context.application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, SharedConversationHandler):
+                key = handler.conversation_key(update)
+                if key is not None:
+                    entries.append((handler, key))
+    if not entries:
+        return
+    states = await persistence.load_conversations([(handler.name, key) for handler, key in entries])
+    for (handler, key), state in zip(entries, states):
+        handler.set_loaded_state(key, state)
+
+class LocalPersistence(PicklePersistence):
+    """
+    PicklePersistence in one file (CONVERSATIONS_FILE) for a single worker.
+    Application hands over changes every `update_interval` seconds; the
+    stock class rewrites the file once per changed key, this one once per
+    batch, and through a temporary file so a crash mid-write cannot leave a
+    truncated pickle behind.
+    """
+
+    def __init__(self, filepath=CONVERSATIONS_FILE, update_interval=PERSISTENCE_UPDATE_INTERVAL):
+        super().__init__(
+            filepath=filepath,
+            store_data=PersistenceInput(callback_data=False),
+            single_file=True,
+            on_flush=False,
+            update_interval=update_interval,
+        )
+        self._write_scheduled = False
+
+    def _dump_singlefile(self):
+        # Called after every changed key: defer the write until the whole batch is applied
+        if self._write_scheduled:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write()
+            return
+        self._write_scheduled = True
+        loop.call_soon(self._write)
+
+    def _write(self):
+        self._write_scheduled = False
+        data = {
+            "conversations": self.conversations,
+            "user_data": self.user_data,
+            "chat_data": self.chat_data,
+            "bot_data": self.bot_data,
+            "callback_data": self.callback_data,
+        }
+        temporary = self.filepath.with_name(self.filepath.name + ".tmp")
+        self._dump_file(temporary, data)
+        os.replace(temporary, self.filepath)
+
+    async def flush(self):
+        # Shutdown: the loop is about to stop, so write now instead of scheduling
+        self._write()
+
+def get_persistence():
+    """Persistence for the Application: the shared backend when there is one, a local pickle file otherwise."""
+    backend = get_backend()
+    if backend is not None:
+        return BackendPersistence(backend)
+    directory = os.path.dirname(CONVERSATIONS_FILE)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return LocalPersistence()
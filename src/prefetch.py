@@ -0,0 +1,64 @@
+# prefetch.py
+
+import asyncio
+from datetime import datetime, time
+
+from config import PREFETCH_TIMES, PREFETCH_CONCURRENCY, PREFETCH_RATE_LIMIT
+from src.utils import MSK, logger
+from src.storage import iter_users
+from src.schedule import get_schedule_key, refresh_schedule
+
+class RateLimiter:
+    """Spaces out request starts to at most `rate` per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            delay = self._next_slot - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_slot = loop.time() + self.interval
+
+def get_known_schedule_keys(users):
+    """Distinct (kind, id) schedules referenced by the stored user settings."""
+    keys = set()
+    for _, user_data in users:
+        kind, schedule_id = get_schedule_key(user_data)
+        keys.add((kind, str(schedule_id)))
+    return sorted(keys)
+
+async def prefetch_schedules(context=None):
+    """
+    JobQueue callback: refresh the schedule cache for every known ID so that
+    requests during the morning peak are served without waiting on Unitech.
+    """
+    keys = get_known_schedule_keys(await iter_users())
+    semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+    limiter = RateLimiter(PREFETCH_RATE_LIMIT)
+    started = datetime.now(MSK)
+
+    async def refresh(kind, schedule_id):
+        async with semaphore:
+            await limiter.wait()
+            await refresh_schedule(kind, schedule_id)
+
+    results = await asyncio.gather(*(refresh(kind, schedule_id) for kind, schedule_id in keys), return_exceptions=True)
+    failed = [(key, result) for key, result in zip(keys, results) if isinstance(result, Exception)]
+    for (kind, schedule_id), error in failed:
+        logger.warning("prefetch failed for %s %s: %s", kind, schedule_id, str(error), extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+    logger.info("prefetched %d of %d schedules in %.1fs", len(keys) - len(failed), len(keys), (datetime.now(MSK) - started).total_seconds(), extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+
+def schedule_prefetch_jobs(job_queue):
+    """Register a daily prefetch job for every time in PREFETCH_TIMES (MSK)."""
+    for time_str in PREFETCH_TIMES:
+        hour, minute = map(int, time_str.split(":"))
+        job_queue.run_daily(
+            prefetch_schedules,
+            time=time(hour, minute, tzinfo=MSK),
+            name=f"prefetch_{time_str}"
+        )
@@ -1,101 +1,187 @@
 # schedule.py
 
-import requests
+import asyncio
+import functools
+import hashlib
+import re
+import sys
+import json
+import os
+import time
+import httpx
 from icalendar import Calendar
-from datetime import datetime, timedelta
+from icalendar.parser import unescape_char
+from datetime import datetime, timedelta, timezone
 import calendar
 
+from config import (
+    SCHEDULE_CACHE_TTL, SCHEDULE_CACHE_MAX_SIZE, SCHEDULE_CACHE_DIR, SCHEDULE_RETRY_INTERVAL,
+    RENDER_CACHE_TTL, RENDER_CACHE_MAX_SIZE, PAIR_TIMES, EVENT_CATEGORY_RULES, EVENT_DEFAULT_CATEGORY,
+    SHARED_SCHEDULE_TTL
+)
+from src import http_client, workers
+from src.backends import get_backend
+from src.cache import TTLCache, SingleFlight
+from src.groups import group_directory
+from src.metrics import cache_seconds, cache_stats, stage_seconds
 from src.utils import MSK, logger
 
-class ScheduleFormatter:
-    @staticmethod
-    def get_pair_number(start_time):
-        pairs = {
-            1: ("09:00", "10:30"),
-            2: ("10:40", "12:10"),
-            3: ("12:30", "14:00"),
-            4: ("14:10", "15:40"),
-            5: ("15:50", "17:20"),
-            6: ("17:25", "18:55"),
-            7: ("19:10", "20:30")
-        }
-        start_time_str = start_time.strftime('%H:%M')
-        for pair_number, (start, end) in pairs.items():
-            if start_time_str == start:
-                return pair_number
-        return None
+# Shared cache of CachedSchedule records keyed by ("student", id) / ("group", id) / ("teacher", id)
+schedule_cache = TTLCache(maxsize=SCHEDULE_CACHE_MAX_SIZE, ttl=SCHEDULE_CACHE_TTL)
+# Concurrent cache misses for the same key share one in-flight download
+schedule_flight = SingleFlight()
+# Reads of the saved copy (disk or shared backend) are coalesced separately, so schedule_flight counts only downloads
+saved_copy_flight = SingleFlight()
+# Formatted schedule texts, see render_schedule
+render_cache = TTLCache(maxsize=RENDER_CACHE_MAX_SIZE, ttl=RENDER_CACHE_TTL)
+cache_stats.register("schedule", schedule_cache)
+cache_stats.register("render", render_cache)
+# Strong references to background refresh tasks (asyncio keeps only weak ones)
+_background_tasks = set()
+# First line of every day in a week schedule; long messages are split before it
+DAY_SEPARATOR = "<----------!---------->"
+
+def _compile_category_rules(rules):
+    """Turn EVENT_CATEGORY_RULES into (first_word_only, search, emoji, category) with one regex per rule."""
+    compiled = []
+    for scope, patterns, emoji, category in rules:
+        if scope not in ("first_word", "anywhere"):
+            raise ValueError(f"Unknown EVENT_CATEGORY_RULES scope: {scope!r}")
+        pattern = re.compile("|".join(re.escape(p.lower()) for p in patterns))
+        compiled.append((scope == "first_word", pattern.search, sys.intern(emoji), sys.intern(category)))
+    return tuple(compiled)
+
+_CATEGORY_RULES = _compile_category_rules(EVENT_CATEGORY_RULES)
+# Pair number by start time as (hour, minute), so no strftime per event
+_PAIR_BY_START = {tuple(map(int, start.split(":"))): pair for pair, (start, end) in PAIR_TIMES.items()}
+
+@functools.lru_cache(maxsize=4096)
+def classify_summary(summary):
+    """
+    Return (emoji, category, title) for an event summary. The title has the
+    type word ("Лек.", "Пр." ...) removed and the category appended. Summaries
+    repeat all semester, so each distinct one is classified once.
+    """
+    words = summary.split()
+    first_word = words[0].lower() if words else ""
+    summary_lower = summary.lower()
+    for first_word_only, search, emoji, category in _CATEGORY_RULES:
+        if search(first_word if first_word_only else summary_lower):
+            title = ' '.join(words[1:]) if len(words) > 1 else summary
+            break
+    else:
+        emoji, category = EVENT_DEFAULT_CATEGORY
+        title = summary
+    return emoji, category, sys.intern(f"{title} ({category})")
+
+class Event:
+    """
+    One VEVENT with plain str fields and MSK start/end datetimes.
+    Text fields are interned: a semester repeats the same subjects, rooms and
+    teachers, so thousands of events share a handful of string objects.
+    The lesson type and pair number are resolved here, once per event.
+    """
+
+    __slots__ = ('summary', 'start', 'end', 'location', 'description', 'emoji', 'category', 'title', 'pair')
+
+    def __init__(self, summary, start, end, location, description):
+        self.summary = sys.intern(str(summary))
+        self.start = start.astimezone(MSK)
+        self.end = end.astimezone(MSK)
+        self.location = sys.intern(str(location))
+        self.description = sys.intern(str(description))
+        self.emoji, self.category, self.title = classify_summary(self.summary)
+        self.pair = _PAIR_BY_START.get((self.start.hour, self.start.minute))
+
+class EventIndex:
+    """
+    Events sorted by start time once and bucketed by MSK date, so day and
+    week lookups are dict lookups.
+    """
+
+    __slots__ = ('events', 'by_date', 'window_start', 'window_end')
+
+    def __init__(self, events, window_start=None, window_end=None):
+        self.events = sorted(events, key=lambda e: e.start)
+        self.by_date = {}
+        for event in self.events:
+            self.by_date.setdefault(event.start.date(), []).append(event)
+        # Date range the events were parsed for; None means unbounded
+        self.window_start = window_start
+        self.window_end = window_end
 
+    def covers(self, start_date, end_date):
+        return ((self.window_start is None or self.window_start <= start_date)
+                and (self.window_end is None or end_date <= self.window_end))
+
+    def on(self, date):
+        """Events of one MSK date in start-time order."""
+        return self.by_date.get(date, [])
+
+    def has_events_between(self, start_date, end_date):
+        return any(self.on(start_date + timedelta(days=offset)) for offset in range((end_date - start_date).days + 1))
+
+    def __len__(self):
+        return len(self.events)
+
+    def __iter__(self):
+        return iter(self.events)
+
+def pack_events(events):
+    """
+    Compact picklable form of an EventIndex for returning it from a worker
+    process: every distinct string once, events as tuples of string indices
+    and UTC timestamps instead of pickled Event objects with their datetimes.
+    """
+    strings = {}
+    def ref(text):
+        return strings.setdefault(text, len(strings))
+    rows = [(ref(e.summary), int(e.start.timestamp()), int(e.end.timestamp()), ref(e.location), ref(e.description)) for e in events]
+    return list(strings), rows, events.window_start, events.window_end
+
+def unpack_events(packed):
+    """EventIndex from pack_events output."""
+    strings, rows, window_start, window_end = packed
+    return EventIndex(
+        (Event(strings[summary], datetime.fromtimestamp(start, MSK), datetime.fromtimestamp(end, MSK), strings[location], strings[description])
+         for summary, start, end, location, description in rows),
+        window_start, window_end
+    )
+
+class ScheduleFormatter:
     @staticmethod
     def format_event(event):
         try:
-            start_time = event['dtstart'].astimezone(MSK)
-            end_time = event['dtend'].astimezone(MSK)
-            start_time_str = start_time.strftime('%H:%M')
-            end_time_str = end_time.strftime('%H:%M')
-            summary = event['summary']
-            location = event['location']
-            description = event['description']
-            
-            summary_lower = summary.lower()
-            if 'зач' in summary_lower.split()[0]:
-                emoji = '✏️'
-                category = 'Зачет'
-                summary = ' '.join(summary.split()[1:]) if len(summary.split()) > 1 else summary
-            elif 'физ' in summary_lower or 'элективные курсы по физической культуре' in summary_lower:
-                emoji = '💪'
-                category = 'Физкультура'
-                summary = ' '.join(summary.split()[1:]) if len(summary.split()) > 1 else summary
-            elif 'лек' in summary_lower.split()[0] or 'лек.' in summary_lower.split()[0]:
-                emoji = '📚'
-                category = 'Лекция'
-                summary = ' '.join(summary.split()[1:]) if len(summary.split()) > 1 else summary
-            elif 'пр' in summary_lower.split()[0] or 'пр.' in summary_lower.split()[0] or 'прак' in summary_lower.split()[0]:
-                emoji = '💻'
-                category = 'Практика'
-                summary = ' '.join(summary.split()[1:]) if len(summary.split()) > 1 else summary
-            elif 'лаб' in summary_lower.split()[0]:
-                emoji = '❗'
-                category = 'Лабораторная'
-                summary = ' '.join(summary.split()[1:]) if len(summary.split()) > 1 else summary
-            else:
-                emoji = '🔔'
-                category = 'Прочее'
-            
-            summary = f"{summary} ({category})"
-            pair_number = ScheduleFormatter.get_pair_number(start_time)
-            time_prefix = f"{pair_number} пара: " if pair_number else ""
-            return f" 🕘 {time_prefix}{start_time_str}-{end_time_str}\n{emoji} {summary}\nАудитория: {location}\n{description}\n"
+            time_prefix = f"{event.pair} пара: " if event.pair else ""
+            start, end = event.start, event.end
+            return f" 🕘 {time_prefix}{start.hour:02d}:{start.minute:02d}-{end.hour:02d}:{end.minute:02d}\n{event.emoji} {event.title}\nАудитория: {event.location}\n{event.description}\n"
         except Exception as e:
             logger.error("failed to format event: %s", str(e), extra={'user_id': 'unknown', 'chat_id': 'unknown', 'username': 'unknown'})
-            return f"🔔 Error formatting event: {event['summary']} ({category})\n"
+            return f"🔔 Error formatting event: {event.summary} ({event.category})\n"
 
     @staticmethod
     def format_daily_schedule(events, date):
-        events = [event for event in events if event['dtstart'].astimezone(MSK).date() == date]
+        day_events = events.on(date)
         day = str(date.day)
         formatted_date = f"{day} {date.strftime('%B (%A)')}"
-        if not events:
+        if not day_events:
             return f"{formatted_date} занятий нет 0_о"
-        sorted_events = sorted(events, key=lambda e: e['dtstart'])
-        return "\n".join(ScheduleFormatter.format_event(event) for event in sorted_events)
+        return "\n".join(ScheduleFormatter.format_event(event) for event in day_events)
 
     @staticmethod
-    def format_week_schedule(events, start_date=None, end_date=None):
-        if start_date and end_date:
-            events = [event for event in events if start_date <= event['dtstart'].astimezone(MSK).date() <= end_date]
-        if not events:
+    def format_week_schedule(events, start_date, end_date):
+        if not events.has_events_between(start_date, end_date):
             return "Расписания на неделю нет."
-        sorted_events = sorted(events, key=lambda e: e['dtstart'])
         current_date = start_date
         schedule = []
         while current_date <= end_date:
-            day_events = [event for event in sorted_events if event['dtstart'].astimezone(MSK).date() == current_date]
+            day_events = events.on(current_date)
             if current_date.weekday() >= 5 and not day_events:
                 current_date += timedelta(days=1)
                 continue
             day = str(current_date.day)
             formatted_date = f"{day} {current_date.strftime('%B (%A)')}"
-            schedule.append(f"<----------!---------->\n📅 {formatted_date}")
+            schedule.append(f"{DAY_SEPARATOR}\n📅 {formatted_date}")
             if day_events:
                 schedule.append("\n".join(ScheduleFormatter.format_event(event) for event in day_events))
             elif current_date.weekday() < 5:
@@ -103,91 +189,503 @@ class ScheduleFormatter:
             current_date += timedelta(days=1)
         return "\n".join(schedule)
 
-def download_ics(id_student):
-    url = f"https://es.unitech-mo.ru/api/Rasp?idStudent={id_student}&iCal=true"
+async def download_rasp(kind, schedule_id, etag=None, last_modified=None):
+    """
+    Download a student or teacher ICS file. Validators of the previous copy are
+    sent as If-None-Match / If-Modified-Since.
+    Returns (ics_content, etag, last_modified); ics_content is None on 304 Not Modified.
+    """
+    label = "teacher ICS file" if kind == "teacher" else "ICS file"
+    params = {'idTeacher' if kind == "teacher" else 'idStudent': schedule_id, 'iCal': 'true'}
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
     try:
-        response = requests.get(url, timeout=10)
+        response = await http_client.get("/Rasp", params=params, headers=headers)
+        if response.status_code == 304:
+            return None, etag, last_modified
         response.raise_for_status()
         if not response.content:
             raise Exception("Empty response from server")
-        return response.content
-    except requests.exceptions.HTTPError as e:
+        return response.content, response.headers.get('ETag'), response.headers.get('Last-Modified')
+    except httpx.HTTPStatusError as e:
         if e.response.status_code == 504:
-            logger.error("failed to download ICS file: %s", str(e), extra={'user_id': 'unknown', 'chat_id': 'unknown', 'username': 'unknown'})
+            logger.error("failed to download %s: %s", label, str(e), extra={'user_id': 'unknown', 'chat_id': 'unknown', 'username': 'unknown'})
             raise Exception("504 Server Error: Gateway Time-out")
-        raise Exception(f"Failed to download ICS file: {str(e)}")
-    except requests.exceptions.ReadTimeout as e:
-        logger.error("failed to download ICS file: %s", str(e), extra={'user_id': 'unknown', 'chat_id': 'unknown', 'username': 'unknown'})
+        raise Exception(f"Failed to download {label}: {str(e)}")
+    except httpx.TimeoutException as e:
+        logger.error("failed to download %s: %s", label, str(e), extra={'user_id': 'unknown', 'chat_id': 'unknown', 'username': 'unknown'})
         raise Exception("Read timeout error: Failed to connect to server")
-    except requests.exceptions.RequestException as e:
-        logger.error("failed to download ICS file: %s", str(e), extra={'user_id': 'unknown', 'chat_id': 'unknown', 'username': 'unknown'})
-        raise Exception(f"Failed to download ICS file: {str(e)}")
+    except httpx.HTTPError as e:
+        logger.error("failed to download %s: %s", label, str(e), extra={'user_id': 'unknown', 'chat_id': 'unknown', 'username': 'unknown'})
+        raise Exception(f"Failed to download {label}: {str(e)}")
 
-def download_teacher_ics(teacher_id):
-    url = f"https://es.unitech-mo.ru/api/Rasp?idTeacher={teacher_id}&iCal=true"
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        if not response.content:
-            raise Exception("Empty response from server")
-        return response.content
-    except requests.exceptions.HTTPError as e:
-        if e.response.status_code == 504:
-            logger.error("failed to download teacher ICS file: %s", str(e), extra={'user_id': 'unknown', 'chat_id': 'unknown', 'username': 'unknown'})
-            raise Exception("504 Server Error: Gateway Time-out")
-        raise Exception(f"Failed to download teacher ICS file: {str(e)}")
-    except requests.exceptions.ReadTimeout as e:
-        logger.error("failed to download teacher ICS file: %s", str(e), extra={'user_id': 'unknown', 'chat_id': 'unknown', 'username': 'unknown'})
-        raise Exception("Read timeout error: Failed to connect to server")
-    except requests.exceptions.RequestException as e:
-        logger.error("failed to download teacher ICS file: %s", str(e), extra={'user_id': 'unknown', 'chat_id': 'unknown', 'username': 'unknown'})
-        raise Exception(f"Failed to download teacher ICS file: {str(e)}")
+async def download_ics(id_student):
+    ics_content, _, _ = await download_rasp("student", id_student)
+    return ics_content
+
+async def download_teacher_ics(teacher_id):
+    ics_content, _, _ = await download_rasp("teacher", teacher_id)
+    return ics_content
 
-def parse_ics(ics_content):
+def parse_ics(ics_content, start_date=None, end_date=None):
+    """
+    Parse an ICS body into an EventIndex. With start_date/end_date only events
+    whose MSK start date falls into the window are materialized.
+    Plain Unitech files go through a line scanner that decodes DTSTART first
+    and skips out-of-window VEVENTs; anything it does not handle (folded lines,
+    TZID or other property parameters, alarms) falls back to Calendar.from_ical.
+    """
     try:
-        cal = Calendar.from_ical(ics_content)
-        events = []
-        for component in cal.walk():
-            if component.name == "VEVENT":
-                event = {
-                    'summary': component.get('summary', 'No summary'),
-                    'dtstart': component.get('dtstart').dt if component.get('dtstart') else None,
-                    'dtend': component.get('dtend').dt if component.get('dtend') else None,
-                    'location': component.get('location', 'No location'),
-                    'description': component.get('description', 'No description'),
-                }
-                if event['dtstart'] is None or event['dtend'] is None:
-                    continue
-                events.append(event)
-        return events
+        events = _parse_ics_stream(ics_content, start_date, end_date)
+        if events is None:
+            events = _parse_ics_full(ics_content, start_date, end_date)
+        return EventIndex(events, start_date, end_date)
     except Exception as e:
         logger.error("failed to parse ICS file: %s", str(e), extra={'user_id': 'unknown', 'chat_id': 'unknown', 'username': 'unknown'})
         raise Exception(f"Failed to parse ICS file: {str(e)}")
 
-def get_today_schedule(events):
+def _in_window(dtstart, start_date, end_date):
+    day = dtstart.astimezone(MSK).date()
+    return (start_date is None or start_date <= day) and (end_date is None or day <= end_date)
+
+def _parse_ics_full(ics_content, start_date=None, end_date=None):
+    cal = Calendar.from_ical(ics_content)
+    events = []
+    for component in cal.walk():
+        if component.name == "VEVENT":
+            dtstart = component.get('dtstart').dt if component.get('dtstart') else None
+            dtend = component.get('dtend').dt if component.get('dtend') else None
+            # All-day (date-only) entries have no time and cannot be placed on the pair grid
+            if not isinstance(dtstart, datetime) or not isinstance(dtend, datetime):
+                continue
+            if not _in_window(dtstart, start_date, end_date):
+                continue
+            events.append(Event(
+                component.get('summary', 'No summary'),
+                dtstart,
+                dtend,
+                component.get('location', 'No location'),
+                component.get('description', 'No description'),
+            ))
+    return events
+
+# Marker returned by the line scanner for constructs only the full parser handles
+_UNSUPPORTED = object()
+
+def _parse_ics_stream(ics_content, start_date=None, end_date=None):
+    """
+    Line scanner for the subset of ICS that Unitech produces. Works on the raw
+    bytes and decodes only the properties of in-window events.
+    Returns None to request the full parser.
+    """
+    data = ics_content.encode('utf-8') if isinstance(ics_content, str) else ics_content
+    if b"\n " in data or b"\n\t" in data:
+        return None  # folded lines
+    # Window bounds as raw UTC values: most DTSTARTs are rejected by a bytes comparison
+    utc_from = _utc_bound(start_date) if start_date else None
+    utc_to = _utc_bound(end_date + timedelta(days=1)) if end_date else None
+    events = []
+    pos = 0
+    while True:
+        begin = data.find(b"BEGIN:VEVENT", pos)
+        if begin < 0:
+            return events
+        end = data.find(b"END:VEVENT", begin)
+        if end < 0:
+            return None
+        pos = end + len(b"END:VEVENT")
+        if data.find(b"BEGIN:", begin + len(b"BEGIN:VEVENT"), end) >= 0:
+            return None  # nested components (VALARM)
+
+        raw_start = _ics_value(data, begin, end, b"DTSTART")
+        if raw_start is not None and raw_start is not _UNSUPPORTED and raw_start.endswith(b"Z"):
+            if (utc_from and raw_start[:-1] < utc_from) or (utc_to and raw_start[:-1] >= utc_to):
+                continue
+        dtstart = _ics_datetime(raw_start)
+        if dtstart is _UNSUPPORTED:
+            return None
+        if dtstart is None or not _in_window(dtstart, start_date, end_date):
+            continue
+        dtend = _ics_datetime(_ics_value(data, begin, end, b"DTEND"))
+        if dtend is _UNSUPPORTED:
+            return None
+        if dtend is None:
+            continue
+
+        summary = _ics_value(data, begin, end, b"SUMMARY")
+        location = _ics_value(data, begin, end, b"LOCATION")
+        description = _ics_value(data, begin, end, b"DESCRIPTION")
+        if _UNSUPPORTED in (summary, location, description):
+            return None
+        events.append(Event(
+            _ics_text(summary, 'No summary'),
+            dtstart,
+            dtend,
+            _ics_text(location, 'No location'),
+            _ics_text(description, 'No description'),
+        ))
+
+def _ics_value(data, begin, end, name):
+    """Raw value of the first `name` property line in the VEVENT at data[begin:end]."""
+    index = data.find(b"\n" + name, begin, end)
+    while index >= 0:
+        value_start = index + 1 + len(name)
+        separator = data[value_start:value_start + 1]
+        if separator == b";":
+            return _UNSUPPORTED  # TZID, VALUE=DATE, LANGUAGE, ...
+        if separator == b":":
+            line_end = data.find(b"\n", value_start, end)
+            value = data[value_start + 1:line_end if line_end >= 0 else end]
+            return value[:-1] if value.endswith(b"\r") else value
+        index = data.find(b"\n" + name, value_start, end)
+    return None
+
+def _utc_bound(msk_date):
+    """Start of an MSK date as a raw ICS UTC value (without the trailing Z)."""
+    start = datetime(msk_date.year, msk_date.month, msk_date.day, tzinfo=MSK).astimezone(timezone.utc)
+    return start.strftime('%Y%m%dT%H%M%S').encode('ascii')
+
+def _ics_text(value, default):
+    return unescape_char(value.decode('utf-8')) if value is not None else default
+
+def _ics_datetime(value):
+    if value is None or value is _UNSUPPORTED:
+        return value
+    try:
+        if len(value) == 16 and value[8:9] == b'T' and value[15:16] == b'Z':
+            return datetime(int(value[0:4]), int(value[4:6]), int(value[6:8]),
+                            int(value[9:11]), int(value[11:13]), int(value[13:15]), tzinfo=timezone.utc)
+        if len(value) == 15 and value[8:9] == b'T':
+            return datetime(int(value[0:4]), int(value[4:6]), int(value[6:8]),
+                            int(value[9:11]), int(value[11:13]), int(value[13:15]))
+        if len(value) == 8:
+            return None  # all-day entry, skipped like in the full parser
+    except ValueError:
+        pass
+    return _UNSUPPORTED
+
+class CachedSchedule:
+    """
+    Parsed events of one schedule, the time they were downloaded and the
+    validators (body hash, ETag, Last-Modified) used to revalidate them.
+    """
+
+    __slots__ = ('events', 'fetched_at', 'content_hash', 'etag', 'last_modified', 'last_attempt', 'refresh_failed')
+
+    def __init__(self, events, fetched_at, content_hash=None, etag=None, last_modified=None):
+        self.events = events
+        self.fetched_at = fetched_at
+        self.content_hash = content_hash
+        self.etag = etag
+        self.last_modified = last_modified
+        self.last_attempt = 0.0
+        self.refresh_failed = False
+
+    def age(self):
+        return time.time() - self.fetched_at
+
+    def stale_note(self):
+        """'Data as of HH:MM' marker for replies built from an outdated copy."""
+        if self.age() < SCHEDULE_CACHE_TTL and not self.refresh_failed:
+            return ""
+        fetched = datetime.fromtimestamp(self.fetched_at, MSK)
+        as_of = fetched.strftime('%H:%M') if fetched.date() == datetime.now(MSK).date() else fetched.strftime('%d.%m %H:%M')
+        if self.refresh_failed:
+            return f"\n\n🕓 Данные от {as_of}: сервер Unitech недоступен, показана сохранённая копия."
+        return f"\n\n🕓 Данные от {as_of}, обновляются."
+
+def _parse_window(today=None):
+    """
+    Dates parsed into the cache: from a week before the current month to the
+    end of the next one, so every view stays inside it for the whole month.
+    """
+    today = today or datetime.now(MSK).date()
+    month_start = today.replace(day=1)
+    next_month = (month_start + timedelta(days=32)).replace(day=1)
+    next_month_end = (next_month + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return month_start - timedelta(days=7), next_month_end
+
+def _view_window(today=None):
+    """Dates the bot can show today: this and next week and every day of the current month."""
+    today = today or datetime.now(MSK).date()
+    _, max_days = calendar.monthrange(today.year, today.month)
+    week_start = today - timedelta(days=today.weekday())
+    return min(today.replace(day=1), week_start), max(today.replace(day=max_days), week_start + timedelta(days=13))
+
+def get_schedule_key(user_data):
+    """
+    Return (kind, id) of the schedule a chat is subscribed to. Student chats
+    with a known group share one ("group", group_id) entry, whichever student
+    of the group was stored for them.
+    """
+    if "id_teacher" in user_data:
+        return "teacher", user_data["id_teacher"]
+    if "group_id" in user_data:
+        return "group", user_data["group_id"]
+    return "student", user_data.get('id_student', 90893)
+
+async def fetch_schedule(kind, schedule_id):
+    """
+    Return a CachedSchedule for a student or teacher schedule.
+    A fresh cache hit skips both the HTTP request and the ICS parse; concurrent
+    misses for the same key share a single download and parse. An expired copy
+    (in memory or on disk) is returned immediately while a refresh runs in the
+    background, so Unitech latency and outages stay out of the reply path.
+    The time taken goes to unitech_cache_lookup_duration_seconds{cache="schedule"}
+    with the result: hit, saved (fresh copy from disk or the shared backend),
+    stale or miss (downloaded).
+    """
+    with cache_seconds.time(cache="schedule", result="miss") as labels:
+        cached, labels['result'] = await _fetch_schedule(kind, schedule_id)
+    return cached
+
+async def _fetch_schedule(kind, schedule_id):
+    """fetch_schedule body: returns (CachedSchedule, result label)."""
+    key = (kind, str(schedule_id))
+    view_window = _view_window()
+    cached = schedule_cache.get(key)
+    if cached is not None and cached.events.covers(*view_window):
+        return cached, "hit"
+
+    stale = schedule_cache.peek(key)
+    if stale is None or not stale.events.covers(*view_window):
+        # Re-parse the saved body for the current window (restart, month rollover or another worker's download);
+        # concurrent requests share one read and parse
+        stale = await saved_copy_flight.do(key, lambda: _read_saved_copy(key))
+    if stale is None:
+        return await schedule_flight.do(key, lambda: _load_schedule(key, kind, schedule_id)), "miss"
+
+    if stale.age() < SCHEDULE_CACHE_TTL:
+        # Copy saved on disk before a restart is still fresh
+        schedule_cache.set(key, stale, ttl=SCHEDULE_CACHE_TTL - stale.age())
+        return stale, "saved"
+    schedule_cache.set(key, stale, ttl=0)
+    _revalidate_in_background(key, kind, schedule_id, stale)
+    return stale, "stale"
+
+async def refresh_schedule(kind, schedule_id):
+    """Download and re-cache a schedule regardless of the cached copy."""
+    key = (kind, str(schedule_id))
+    return await schedule_flight.do(key, lambda: _load_schedule(key, kind, schedule_id))
+
+async def _load_schedule(key, kind, schedule_id):
+    previous = schedule_cache.peek(key)
+    if previous is None or not previous.events.covers(*_view_window()):
+        previous = None
+    if get_backend() is not None:
+        shared = await _read_shared_copy(key, previous)
+        if shared is not None and (previous is None or shared.fetched_at > previous.fetched_at):
+            if shared.age() < SCHEDULE_CACHE_TTL:
+                # Another worker has just downloaded this schedule
+                schedule_cache.set(key, shared, ttl=SCHEDULE_CACHE_TTL - shared.age())
+                return shared
+            previous = shared
+    if previous is None:
+        previous = await _read_disk_copy(key)
+    source_kind, source_id = await _download_source(kind, schedule_id)
+    if previous is not None:
+        ics_content, etag, last_modified = await download_rasp(source_kind, source_id, previous.etag, previous.last_modified)
+    else:
+        ics_content, etag, last_modified = await download_rasp(source_kind, source_id)
+
+    content_hash = hashlib.sha1(ics_content).hexdigest() if ics_content is not None else None
+    if previous is not None and (ics_content is None or content_hash == previous.content_hash):
+        # Not modified (304 or identical body): keep the parsed events, skip the parse
+        cached = CachedSchedule(previous.events, time.time(), previous.content_hash, etag, last_modified)
+        _touch_disk_copy(key, cached)
+        await _write_shared_copy(key, None, cached)
+        unchanged = True
+    else:
+        cached = CachedSchedule(await parse_schedule(ics_content, content_hash), time.time(), content_hash, etag, last_modified)
+        _write_disk_copy(key, ics_content, cached)
+        await _write_shared_copy(key, ics_content, cached)
+        unchanged = False
+    schedule_cache.set(key, cached)
+    logger.info("cached schedule %s %s (%d events, %s), cache stats: %s, coalescing stats: %s", kind, schedule_id, len(cached.events), "unchanged" if unchanged else "parsed", schedule_cache.stats(), schedule_flight.stats(), extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+    return cached
+
+async def _download_source(kind, schedule_id):
+    """Unitech serves ICS per student or teacher: a group is fetched via its representative student."""
+    if kind != "group":
+        return kind, schedule_id
+    student_id = await group_directory.get_student_id(schedule_id)
+    if student_id is None:
+        raise Exception(f"No students found for group {schedule_id}")
+    return "student", student_id
+
+def _revalidate_in_background(key, kind, schedule_id, stale):
+    if key in schedule_flight or time.time() - stale.last_attempt < SCHEDULE_RETRY_INTERVAL:
+        return
+    stale.last_attempt = time.time()
+    task = asyncio.create_task(_revalidate(kind, schedule_id, stale))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def _revalidate(kind, schedule_id, stale):
+    try:
+        await refresh_schedule(kind, schedule_id)
+    except Exception as e:
+        stale.refresh_failed = True
+        logger.warning("background refresh of %s %s failed, serving copy from %s: %s", kind, schedule_id, datetime.fromtimestamp(stale.fetched_at, MSK).strftime('%d.%m %H:%M'), str(e), extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+
+def _disk_copy_path(key):
+    kind, schedule_id = key
+    return os.path.join(SCHEDULE_CACHE_DIR, f"{kind}_{schedule_id}.ics")
+
+def _write_disk_copy(key, ics_content, cached):
+    path = _disk_copy_path(key)
+    try:
+        os.makedirs(SCHEDULE_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(ics_content)
+        os.replace(tmp_path, path)
+        _write_validators(path, cached)
+    except OSError as e:
+        logger.error("failed to save schedule copy %s: %s", path, str(e), extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+
+def _touch_disk_copy(key, cached):
+    """Mark an unchanged disk copy as fetched now and store the new validators."""
+    path = _disk_copy_path(key)
+    try:
+        if os.path.exists(path):
+            os.utime(path, (cached.fetched_at, cached.fetched_at))
+            _write_validators(path, cached)
+    except OSError as e:
+        logger.error("failed to update schedule copy %s: %s", path, str(e), extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+
+def _write_validators(path, cached):
+    tmp_path = f"{path}.json.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'etag': cached.etag, 'last_modified': cached.last_modified}, f)
+    os.replace(tmp_path, f"{path}.json")
+
+async def _read_disk_copy(key):
+    path = _disk_copy_path(key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            ics_content = f.read()
+        validators = {}
+        if os.path.exists(f"{path}.json"):
+            with open(f"{path}.json", 'r', encoding='utf-8') as f:
+                validators = json.load(f)
+        content_hash = hashlib.sha1(ics_content).hexdigest()
+        return CachedSchedule(
+            await parse_schedule(ics_content, content_hash), os.path.getmtime(path), content_hash,
+            validators.get('etag'), validators.get('last_modified')
+        )
+    except Exception as e:
+        logger.error("failed to load schedule copy %s: %s", path, str(e), extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+        return None
+
+async def _read_saved_copy(key):
+    """Last downloaded copy: the shared one (any worker's download) if there is a shared backend, else the disk copy."""
+    if get_backend() is not None:
+        shared = await _read_shared_copy(key)
+        if shared is not None:
+            return shared
+    return await _read_disk_copy(key)
+
+def _shared_copy_key(key):
+    kind, schedule_id = key
+    return f"schedule:{kind}:{schedule_id}"
+
+async def _write_shared_copy(key, ics_content, cached):
+    """
+    Publish a download to the other workers: validators and fetch time under
+    "<key>:meta", the body under "<key>:ics" (only rewritten when it changed).
+    """
+    backend = get_backend()
+    if backend is None:
+        return
+    shared_key = _shared_copy_key(key)
+    meta = json.dumps({'fetched_at': cached.fetched_at, 'content_hash': cached.content_hash, 'etag': cached.etag, 'last_modified': cached.last_modified})
+    try:
+        if ics_content is not None:
+            await asyncio.to_thread(backend.set, f"{shared_key}:ics", ics_content, SHARED_SCHEDULE_TTL)
+        await asyncio.to_thread(backend.set, f"{shared_key}:meta", meta, SHARED_SCHEDULE_TTL)
+    except Exception as e:
+        logger.error("failed to publish schedule copy %s: %s", shared_key, str(e), extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+
+async def _read_shared_copy(key, previous=None):
+    """
+    Copy published by any worker, or None. If its body hash matches `previous`,
+    the events of `previous` are reused and the body is not even fetched.
+    """
+    backend = get_backend()
+    shared_key = _shared_copy_key(key)
+    try:
+        meta = await asyncio.to_thread(backend.get, f"{shared_key}:meta")
+        if meta is None:
+            return None
+        meta = json.loads(meta)
+        if previous is not None and meta['content_hash'] == previous.content_hash:
+            events = previous.events
+        else:
+            ics_content = await asyncio.to_thread(backend.get, f"{shared_key}:ics")
+            if ics_content is None:
+                return None
+            events = await parse_schedule(ics_content, meta['content_hash'])
+        return CachedSchedule(events, meta['fetched_at'], meta['content_hash'], meta['etag'], meta['last_modified'])
+    except Exception as e:
+        logger.error("failed to load schedule copy %s: %s", shared_key, str(e), extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+        return None
+
+async def parse_schedule(ics_content, content_hash):
+    """
+    parse_ics for the current window (_parse_window). With SCHEDULE_POOL on
+    (src/workers.py) the parse runs in the pool, which also renders this and
+    next week into render_cache while it has the events at hand; a process
+    pool sends the events back packed (pack_events).
+    """
+    if workers.get_executor() is None:
+        with stage_seconds.time(stage="parse"):
+            return parse_ics(ics_content, *_parse_window())
     today = datetime.now(MSK).date()
+    # Includes the wait for a free worker and the week renders done alongside
+    with stage_seconds.time(stage="parse_in_pool"):
+        events, renders = await workers.run(_parse_and_render, ics_content, *_parse_window(today), today, workers.uses_processes())
+    if workers.uses_processes():
+        events = unpack_events(events)
+    for view, result in renders.items():
+        render_cache.set((content_hash, view, today, None), result)
+    return events
+
+def _parse_and_render(ics_content, start_date, end_date, today, pack):
+    """Pool job: parse an ICS body and render the week views that are slowest to format."""
+    events = parse_ics(ics_content, start_date, end_date)
+    renders = {view: _VIEWS[view](events, today) for view in ('week', 'next_week')}
+    return (pack_events(events) if pack else events), renders
+
+def get_today_schedule(events, today=None):
+    today = today or datetime.now(MSK).date()
     return ScheduleFormatter.format_daily_schedule(events, today), today
 
-def get_tomorrow_schedule(events):
-    tomorrow = datetime.now(MSK).date() + timedelta(days=1)
+def get_tomorrow_schedule(events, today=None):
+    tomorrow = (today or datetime.now(MSK).date()) + timedelta(days=1)
     return ScheduleFormatter.format_daily_schedule(events, tomorrow), tomorrow
 
-def get_week_schedule(events):
-    today = datetime.now(MSK).date()
+def get_week_schedule(events, today=None):
+    today = today or datetime.now(MSK).date()
     days_since_monday = today.weekday()
     start_date = today - timedelta(days=days_since_monday)
     end_date = start_date + timedelta(days=6)
     return ScheduleFormatter.format_week_schedule(events, start_date, end_date), None
 
-def get_next_week_schedule(events):
-    today = datetime.now(MSK).date()
+def get_next_week_schedule(events, today=None):
+    today = today or datetime.now(MSK).date()
     days_until_monday = (7 - today.weekday()) % 7 or 7
     start_date = today + timedelta(days=days_until_monday)
     end_date = start_date + timedelta(days=6)
     return ScheduleFormatter.format_week_schedule(events, start_date, end_date), None
 
-def get_day_schedule(events, day):
-    today = datetime.now(MSK)
+def get_day_schedule(events, day, today=None):
+    today = today or datetime.now(MSK).date()
     year, month = today.year, today.month
     _, max_days = calendar.monthrange(year, month)
     if not (1 <= day <= max_days):
@@ -197,3 +695,35 @@ def get_day_schedule(events, day):
         return ScheduleFormatter.format_daily_schedule(events, target_date), target_date
     except ValueError:
         return f"Ошибка: день {day} недопустим для текущего месяца.", None
+
+_VIEWS = {
+    'today': get_today_schedule,
+    'tomorrow': get_tomorrow_schedule,
+    'week': get_week_schedule,
+    'next_week': get_next_week_schedule,
+}
+
+def render_schedule(cached, view, day=None):
+    """
+    Formatted text of a view ('today', 'tomorrow', 'week', 'next_week' or 'day')
+    for a CachedSchedule, same result as the get_*_schedule functions.
+    Results are cached by (content hash, view, date, day): everyone looking at
+    the same schedule on the same date shares one render, and a changed
+    schedule gets a new hash and therefore new entries.
+    """
+    today = datetime.now(MSK).date()
+    render_key = (cached.content_hash, view, today, day)
+    with cache_seconds.time(cache="render", result="miss") as labels:
+        if cached.content_hash is not None:
+            result = render_cache.get(render_key)
+            if result is not None:
+                labels['result'] = "hit"
+                return result
+        with stage_seconds.time(stage=f"render_{view}"):
+            if view == 'day':
+                result = get_day_schedule(cached.events, day, today)
+            else:
+                result = _VIEWS[view](cached.events, today)
+        if cached.content_hash is not None:
+            render_cache.set(render_key, result)
+        return result
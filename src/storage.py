@@ -0,0 +1,319 @@
+# storage.py
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+import json
+import sqlite3
+import threading
+
+from config import USERS_DB_FILE, USERS_JSON_FILE
+from src.backends import get_backend
+from src.utils import logger
+
+class UserStore:
+    """
+    Per-chat user settings in SQLite (WAL mode). Each chat is one row holding
+    the same dict that used to live in users.json, so reads and writes touch
+    primary-key rows only, regardless of the number of chats.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS users (chat_id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def get_user(self, chat_id):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM users WHERE chat_id = ?", (str(chat_id),)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def put_many(self, users):
+        """Write a batch of {chat_id: settings} in a single transaction."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO users (chat_id, data) VALUES (?, ?)",
+                    ((str(chat_id), json.dumps(user_data, ensure_ascii=False)) for chat_id, user_data in users.items())
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def iter_users(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT chat_id, data FROM users").fetchall()
+        for chat_id, data in rows:
+            yield chat_id, json.loads(data)
+
+    def migrate_from_json(self, json_path):
+        """One-time import of an existing users.json into the database."""
+        if self._conn.execute("SELECT 1 FROM meta WHERE key = 'users_json_migrated'").fetchone():
+            return
+        users_data = {}
+        if os.path.isfile(json_path):
+            try:
+                with open(json_path, 'r', encoding='utf-8') as f:
+                    users_data = json.load(f)
+            except Exception as e:
+                logger.error("Failed to read %s for migration: %s", json_path, str(e), extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+                return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO users (chat_id, data) VALUES (?, ?)",
+                    ((str(chat_id), json.dumps(user_data, ensure_ascii=False)) for chat_id, user_data in users_data.items())
+                )
+                self._conn.execute("INSERT INTO meta (key, value) VALUES ('users_json_migrated', ?)", (json_path,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        logger.info("Migrated %d users from %s to %s", len(users_data), json_path, USERS_DB_FILE, extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+
+    def close(self):
+        self._conn.close()
+
+class CachedUserStore:
+    """
+    Write-behind cache over UserStore. All settings are loaded once at startup,
+    reads and mutations only touch memory, and changed chats are written to the
+    database in batches by flush() (periodic job and shutdown).
+    """
+
+    # Methods only touch memory and can be called on the event loop
+    blocking = False
+
+    def __init__(self, store):
+        self._store = store
+        self._users = dict(store.iter_users())
+        self._dirty = set()
+
+    def get_user(self, chat_id):
+        # Copy so callers cannot mutate the cached settings behind our back
+        return dict(self._users.get(str(chat_id), {}))
+
+    def create_user(self, chat_id, user_data):
+        """Add settings for a new chat; existing settings are left untouched."""
+        chat_key = str(chat_id)
+        if chat_key not in self._users:
+            self._users[chat_key] = dict(user_data)
+            self._dirty.add(chat_key)
+
+    def set_student(self, chat_id, id_student, group_name, group_id=None):
+        """Switch a chat to a student schedule, clearing teacher mode."""
+        values = {'id_student': id_student, 'group_name': group_name}
+        if group_id is not None:
+            values['group_id'] = group_id
+        self._update(chat_id, values, ('id_teacher', 'teacher_name', 'group_id'))
+
+    def set_group_id(self, chat_id, group_id):
+        """Record the group of a student chat without touching other settings."""
+        self._update(chat_id, {'group_id': group_id}, ())
+
+    def set_teacher(self, chat_id, id_teacher, teacher_name):
+        """Switch a chat to a teacher schedule, clearing student mode."""
+        self._update(chat_id, {'id_teacher': id_teacher, 'teacher_name': teacher_name}, ('id_student', 'group_name', 'group_id'))
+
+    def iter_users(self):
+        return iter(list(self._users.items()))
+
+    def _update(self, chat_id, values, remove_keys):
+        chat_key = str(chat_id)
+        user_data = dict(self._users.get(chat_key, {}))
+        for key in remove_keys:
+            user_data.pop(key, None)
+        user_data.update(values)
+        self._users[chat_key] = user_data
+        self._dirty.add(chat_key)
+
+    def pending(self):
+        return len(self._dirty)
+
+    def __len__(self):
+        return len(self._users)
+
+    def _take_batch(self):
+        batch = {chat_key: self._users[chat_key] for chat_key in self._dirty}
+        self._dirty.clear()
+        return batch
+
+    def flush(self):
+        """Synchronously write all pending changes in one transaction."""
+        batch = self._take_batch()
+        if batch:
+            try:
+                self._store.put_many(batch)
+            except Exception:
+                self._dirty.update(batch)
+                raise
+        return len(batch)
+
+    async def flush_async(self):
+        """Same as flush(), with the database write moved off the event loop."""
+        batch = self._take_batch()
+        if batch:
+            try:
+                await asyncio.to_thread(self._store.put_many, batch)
+            except Exception:
+                self._dirty.update(batch)
+                raise
+        return len(batch)
+
+    def close(self):
+        self.flush()
+        self._store.close()
+
+class BackendUserStore:
+    """
+    Same interface as CachedUserStore, but every read and write goes to a
+    shared state backend, so all bot workers see a settings change at once.
+    Each chat is a hash "user:<chat_id>" with one JSON-encoded value per
+    setting; a change sets and deletes its fields in one atomic step, so two
+    workers updating the same chat do not overwrite each other. Nothing is
+    buffered, so flush() has nothing to do.
+    """
+
+    # Methods do network I/O: the module-level functions run them in a thread
+    blocking = True
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    @staticmethod
+    def _encode(user_data):
+        return {field: json.dumps(value, ensure_ascii=False) for field, value in user_data.items()}
+
+    @staticmethod
+    def _decode(fields):
+        return {field: json.loads(value) for field, value in fields.items()}
+
+    def get_user(self, chat_id):
+        return self._decode(self._backend.get_hash(f"user:{chat_id}"))
+
+    def create_user(self, chat_id, user_data):
+        self._backend.update_hash(f"user:{chat_id}", self._encode(user_data), only_if_missing=True)
+
+    def set_student(self, chat_id, id_student, group_name, group_id=None):
+        values = {'id_student': id_student, 'group_name': group_name}
+        if group_id is not None:
+            values['group_id'] = group_id
+        self._update(chat_id, values, ('id_teacher', 'teacher_name', 'group_id'))
+
+    def set_group_id(self, chat_id, group_id):
+        self._update(chat_id, {'group_id': group_id}, ())
+
+    def set_teacher(self, chat_id, id_teacher, teacher_name):
+        self._update(chat_id, {'id_teacher': id_teacher, 'teacher_name': teacher_name}, ('id_student', 'group_name', 'group_id'))
+
+    def _update(self, chat_id, values, remove_keys):
+        remove = [key for key in remove_keys if key not in values]
+        self._backend.update_hash(f"user:{chat_id}", self._encode(values), remove)
+
+    def iter_users(self):
+        keys = self._backend.scan("user:")
+        for key, fields in zip(keys, self._backend.get_hashes(keys)):
+            if fields:
+                yield key[len("user:"):], self._decode(fields)
+
+    def import_users(self, users):
+        """Copy settings from the local database; chats already in the backend win."""
+        imported = 0
+        for chat_id, user_data in users:
+            imported += self._backend.update_hash(f"user:{chat_id}", self._encode(user_data), only_if_missing=True)
+        return imported
+
+    def pending(self):
+        return 0
+
+    def __len__(self):
+        return len(self._backend.scan("user:"))
+
+    def flush(self):
+        return 0
+
+    async def flush_async(self):
+        return 0
+
+    def close(self):
+        pass
+
+_store = None
+
+def get_user_store():
+    """
+    Open the shared store on first use: import users.json once, then load all
+    settings into the write-behind cache, or use the shared state backend if
+    STATE_BACKEND is networked.
+    """
+    global _store
+    if _store is None:
+        backend = get_backend()
+        store = UserStore(USERS_DB_FILE)
+        store.migrate_from_json(USERS_JSON_FILE)
+        if backend is not None:
+            # Workers share settings through the backend; the first one to start imports the local database
+            _store = BackendUserStore(backend)
+            if backend.set("meta:users_imported", USERS_DB_FILE, only_if_missing=True):
+                imported = _store.import_users(store.iter_users())
+                logger.info("Imported %d users from %s to the shared backend", imported, USERS_DB_FILE, extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+            store.close()
+        else:
+            _store = CachedUserStore(store)
+            logger.info("Loaded %d users from %s", len(_store), USERS_DB_FILE, extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+    return _store
+
+async def flush_users(context=None):
+    """JobQueue callback: write pending user settings changes to the database."""
+    if _store is None:
+        return
+    try:
+        written = await _store.flush_async()
+    except Exception as e:
+        logger.error("Failed to flush user settings: %s", str(e), extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+        return
+    if written:
+        logger.info("Flushed %d changed users to %s", written, USERS_DB_FILE, extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+
+def close_user_store():
+    """Flush pending changes and close the database (called on shutdown)."""
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
+
+async def _call(method, *args):
+    """Run a user store method; on the shared backend it waits for the network, so in a worker thread."""
+    if get_user_store().blocking:
+        return await asyncio.to_thread(method, *args)
+    return method(*args)
+
+async def get_user(chat_id):
+    return await _call(get_user_store().get_user, chat_id)
+
+async def create_user(chat_id, user_data):
+    await _call(get_user_store().create_user, chat_id, user_data)
+
+async def set_student(chat_id, id_student, group_name, group_id=None):
+    await _call(get_user_store().set_student, chat_id, id_student, group_name, group_id)
+
+async def set_group_id(chat_id, group_id):
+    await _call(get_user_store().set_group_id, chat_id, group_id)
+
+async def set_teacher(chat_id, id_teacher, teacher_name):
+    await _call(get_user_store().set_teacher, chat_id, id_teacher, teacher_name)
+
+async def iter_users():
+    """(chat_id, settings) of every chat, as a list."""
+    return await _call(lambda: list(get_user_store().iter_users()))
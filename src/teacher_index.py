@@ -0,0 +1,117 @@
+# teacher_index.py
+
+import heapq
+import re
+from bisect import bisect_left
+
+# Query tokens at least this long get typo tolerance (one edit) when nothing matches as typed
+FUZZY_MIN_LENGTH = 4
+
+# Match quality of one query token against a name token
+_EXACT, _PREFIX, _FUZZY = 3, 2, 1
+
+_SEPARATORS = re.compile(r"[\W_]+")
+
+def normalize_name(text):
+    """Lowercase, ё→е, split on spaces and punctuation ("Иванов И.И." -> ["иванов", "и", "и"])."""
+    return [token for token in _SEPARATORS.split(text.lower().replace('ё', 'е')) if token]
+
+def _deletes(token):
+    """The token itself plus every variant with one character removed."""
+    return {token} | {token[:i] + token[i + 1:] for i in range(len(token))}
+
+def _within_one_edit(a, b):
+    """True if a and b differ by at most one insertion, deletion, substitution or adjacent swap."""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    i = 0
+    while i < min(len(a), len(b)) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return (a[i + 1:] == b[i + 1:]
+                or (i + 1 < len(a) and a[i] == b[i + 1] and a[i + 1] == b[i] and a[i + 2:] == b[i + 2:]))
+    if len(a) > len(b):
+        return a[i + 1:] == b[i:]
+    return a[i:] == b[i + 1:]
+
+class TeacherIndex:
+    """
+    Search index over the /raspTeacherlist entries, built once per list.
+    Names are normalized into tokens; a query matches a teacher when every
+    query token matches one of the name tokens exactly, as a prefix or, if
+    neither finds anything, within one typo. Results are ranked best first.
+    """
+
+    def __init__(self, teachers):
+        self.teachers = list(teachers)
+        self._by_id = {}
+        self._tokens = []
+        self._postings = {}
+        self._deletes = {}
+        for position, teacher in enumerate(self.teachers):
+            self._by_id[str(teacher.get("id"))] = teacher
+            tokens = normalize_name(teacher.get("name", ""))
+            self._tokens.append(tokens)
+            for token in tokens:
+                self._postings.setdefault(token, set()).add(position)
+        # Sorted distinct tokens for prefix lookups by bisection
+        self._sorted_tokens = sorted(self._postings)
+        for token in self._sorted_tokens:
+            if len(token) >= FUZZY_MIN_LENGTH - 1:
+                for key in _deletes(token):
+                    self._deletes.setdefault(key, set()).add(token)
+
+    def get(self, teacher_id):
+        return self._by_id.get(str(teacher_id))
+
+    def __len__(self):
+        return len(self.teachers)
+
+    def _token_matches(self, query_token):
+        """{teacher position: match quality} for one query token."""
+        matches = {}
+        start = bisect_left(self._sorted_tokens, query_token)
+        for token in self._sorted_tokens[start:]:
+            if not token.startswith(query_token):
+                break
+            quality = _EXACT if token == query_token else _PREFIX
+            for position in self._postings[token]:
+                if matches.get(position, 0) < quality:
+                    matches[position] = quality
+        if not matches and len(query_token) >= FUZZY_MIN_LENGTH:
+            candidates = set()
+            for key in _deletes(query_token):
+                candidates |= self._deletes.get(key, set())
+            for token in candidates:
+                if _within_one_edit(query_token, token):
+                    for position in self._postings[token]:
+                        matches[position] = _FUZZY
+        return matches
+
+    def search(self, query, limit=None):
+        """Teachers matching `query`, best first; at most `limit` of them if given."""
+        query_tokens = normalize_name(query)
+        if not query_tokens:
+            return []
+        scores = None
+        # Rarest tokens first so the intersection shrinks as early as possible
+        for token_matches in sorted(map(self._token_matches, query_tokens), key=len):
+            if scores is None:
+                scores = dict(token_matches)
+            else:
+                scores = {position: score + token_matches[position] for position, score in scores.items() if position in token_matches}
+            if not scores:
+                return []
+
+        first = query_tokens[0]
+        def rank(position):
+            tokens = self._tokens[position]
+            # A query that starts with the surname beats one that matches a first name or patronymic
+            surname_first = bool(tokens) and tokens[0].startswith(first)
+            return (-scores[position], not surname_first, len(tokens), self.teachers[position].get("name", ""))
+
+        if limit is None:
+            ranked = sorted(scores, key=rank)
+        else:
+            ranked = heapq.nsmallest(limit, scores, key=rank)
+        return [self.teachers[position] for position in ranked]
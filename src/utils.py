@@ -5,10 +5,9 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import re
-import json
 from datetime import timedelta, timezone
 
-from config import API_KEY_FILE, USERS_JSON_FILE
+from config import API_KEY_FILE, MESSAGE_MAX_LENGTH
 from src.logging_setup import setup_logging
 
 logger = setup_logging()
@@ -37,21 +36,46 @@ def load_api_key():
     
     return api_key
 
-def load_users():
-    if not os.path.exists(USERS_JSON_FILE):
-        with open(USERS_JSON_FILE, 'w', encoding='utf-8') as f:
-            json.dump({}, f)
-        logger.info("Created empty users.json", extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
-    try:
-        with open(USERS_JSON_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception as e:
-        logger.error("Failed to load users.json: %s", str(e), extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
-        return {}
+def message_length(text):
+    """Length as Telegram counts it: UTF-16 code units (most emoji take two)."""
+    return len(text.encode('utf-16-le')) // 2
 
-def save_users(users_data):
-    try:
-        with open(USERS_JSON_FILE, 'w', encoding='utf-8') as f:
-            json.dump(users_data, f, indent=4, ensure_ascii=False)
-    except Exception as e:
-        logger.error("Failed to save users.json: %s", str(e), extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
\ No newline at end of file
+def split_message(text, separator="\n", limit=MESSAGE_MAX_LENGTH):
+    """
+    Split text into as few messages of at most `limit` as possible, breaking
+    only before `separator` (e.g. a day header). A block that alone is too long
+    is split on lines, and a too long line is cut.
+    """
+    if message_length(text) <= limit:
+        return [text]
+    blocks = text.split(separator)
+    # Keep the separator (minus its leading newline) at the start of the block it introduced
+    blocks = blocks[:1] + [separator.lstrip("\n") + block for block in blocks[1:]]
+    chunks = []
+    current = None
+    for block in blocks:
+        candidate = block if current is None else f"{current}\n{block}"
+        if message_length(candidate) <= limit:
+            current = candidate
+            continue
+        if current is not None:
+            chunks.append(current)
+        if message_length(block) <= limit:
+            current = block
+        elif separator != "\n":
+            *parts, current = split_message(block, "\n", limit)
+            chunks.extend(parts)
+        else:
+            # A single line longer than the limit: cut it into limit-sized pieces
+            pieces = []
+            while message_length(block) > limit:
+                cut = limit
+                while message_length(block[:cut]) > limit:
+                    cut -= 1
+                pieces.append(block[:cut])
+                block = block[cut:]
+            chunks.extend(pieces)
+            current = block
+    if current:
+        chunks.append(current)
+    return chunks
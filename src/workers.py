@@ -0,0 +1,55 @@
+# workers.py
+
+import asyncio
+import locale
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from config import SCHEDULE_POOL, SCHEDULE_POOL_WORKERS
+from src.utils import logger
+
+_executor = None
+
+def uses_processes():
+    """True if pool jobs run in other processes, so arguments and results are pickled."""
+    return SCHEDULE_POOL == "process"
+
+def _init_process(time_locale):
+    # Month and weekday names in rendered schedules come from LC_TIME, which a spawned worker does not inherit
+    try:
+        locale.setlocale(locale.LC_TIME, time_locale)
+    except locale.Error:
+        pass
+
+def get_executor():
+    """
+    Executor for CPU-bound schedule work selected by SCHEDULE_POOL:
+    None ("off", run on the event loop), a thread pool or a process pool
+    with SCHEDULE_POOL_WORKERS workers, created on first use.
+    """
+    global _executor
+    if _executor is None and SCHEDULE_POOL != "off":
+        if SCHEDULE_POOL == "thread":
+            _executor = ThreadPoolExecutor(max_workers=SCHEDULE_POOL_WORKERS, thread_name_prefix="schedule")
+        elif SCHEDULE_POOL == "process":
+            # spawn: forking a process that runs the event loop and its threads is unsafe
+            _executor = ProcessPoolExecutor(
+                max_workers=SCHEDULE_POOL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_process,
+                initargs=(locale.setlocale(locale.LC_TIME),)
+            )
+        else:
+            raise ValueError(f"Unknown SCHEDULE_POOL: {SCHEDULE_POOL!r}")
+        logger.info("schedule %s pool with %d workers", SCHEDULE_POOL, SCHEDULE_POOL_WORKERS, extra={'user_id': 'system', 'chat_id': 'system', 'username': 'unknown'})
+    return _executor
+
+async def run(func, *args):
+    """Run func(*args) in the schedule pool; callers check get_executor() first (None when SCHEDULE_POOL is off)."""
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), func, *args)
+
+def shutdown_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,22 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from resp_server import RespStandIn
+from src.backends import RedisBackend
+
+@pytest.fixture
+def resp_server():
+    server = RespStandIn(password="secret")
+    yield server
+    server.close()
+
+@pytest.fixture
+def redis_backend(resp_server):
+    backend = RedisBackend(resp_server.url(password="secret", db=2))
+    yield backend
+    backend.close()
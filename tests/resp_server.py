@@ -0,0 +1,200 @@
+# resp_server.py
+#
+# In-process stand-in for a Redis server: speaks RESP2 over a local socket
+# and implements the commands src/backends.py sends. SCAN returns small
+# pages so the client has to follow the cursor.
+
+import re
+import socket
+import socketserver
+import threading
+import time
+
+def redis_glob(pattern):
+    """Regex for a Redis MATCH pattern: * ? [...] and backslash escapes."""
+    parts, i = [], 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\" and i + 1 < len(pattern):
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+            continue
+        if char == "*":
+            parts.append(".*")
+        elif char == "?":
+            parts.append(".")
+        elif char == "[":
+            end = pattern.index("]", i)
+            parts.append(pattern[i:end + 1])
+            i = end
+        else:
+            parts.append(re.escape(char))
+        i += 1
+    return re.compile("".join(parts) + r"\Z", re.S)
+
+class RespStandIn:
+    def __init__(self, password=None, scan_page=2):
+        self.password = password
+        self.scan_page = scan_page
+        self.data = {}
+        self.versions = {}
+        self.commands = []
+        self._lock = threading.Lock()
+        self._sockets = set()
+        stand_in = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                stand_in._sockets.add(self.connection)
+                session = {'authenticated': stand_in.password is None, 'db': 0, 'watched': {}, 'queue': None}
+                try:
+                    while True:
+                        args = stand_in._read_command(self.rfile)
+                        if args is None:
+                            return
+                        self.wfile.write(stand_in._dispatch(session, args))
+                except (OSError, ValueError):
+                    pass
+                finally:
+                    stand_in._sockets.discard(self.connection)
+
+        class Server(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        self._server = Server(("127.0.0.1", 0), Handler)
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def url(self, password=None, db=0):
+        auth = f":{password}@" if password else ""
+        return f"redis://{auth}127.0.0.1:{self.port}/{db}"
+
+    def drop_connections(self):
+        """Close every client connection, as a restarted server would."""
+        for sock in list(self._sockets):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self):
+        self.drop_connections()
+        self._server.shutdown()
+        self._server.server_close()
+
+    @staticmethod
+    def _read_command(rfile):
+        line = rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(rfile.readline()[1:-2])
+            args.append(rfile.read(length + 2)[:-2])
+        return args
+
+    @staticmethod
+    def _bulk(value):
+        return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def _array(self, items):
+        return b"*%d\r\n" % len(items) + b"".join(self._bulk(item) for item in items)
+
+    def _live(self, key):
+        entry = self.data.get(key)
+        if entry is not None and entry[0] is not None and entry[0] <= time.time():
+            del self.data[key]
+            return None
+        return entry
+
+    def _touch(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def _dispatch(self, session, args):
+        name = args[0].upper()
+        with self._lock:
+            self.commands.append([name] + args[1:])
+            if name == b"AUTH":
+                session['authenticated'] = args[-1].decode() == self.password
+                return b"+OK\r\n" if session['authenticated'] else b"-WRONGPASS invalid password\r\n"
+            if not session['authenticated']:
+                return b"-NOAUTH Authentication required.\r\n"
+            if name == b"SELECT":
+                session['db'] = int(args[1])
+                return b"+OK\r\n"
+            if name == b"WATCH":
+                for key in args[1:]:
+                    session['watched'][key] = self.versions.get(key, 0)
+                return b"+OK\r\n"
+            if name == b"UNWATCH":
+                session['watched'] = {}
+                return b"+OK\r\n"
+            if name == b"MULTI":
+                session['queue'] = []
+                return b"+OK\r\n"
+            if name == b"EXEC":
+                queue, session['queue'] = session['queue'], None
+                watched, session['watched'] = session['watched'], {}
+                if any(self.versions.get(key, 0) != version for key, version in watched.items()):
+                    return b"*-1\r\n"
+                return b"*%d\r\n" % len(queue) + b"".join(self._run(command) for command in queue)
+            if session['queue'] is not None:
+                session['queue'].append(args)
+                return b"+QUEUED\r\n"
+            return self._run(args)
+
+    def _run(self, args):
+        name, key = args[0].upper(), args[1] if len(args) > 1 else None
+        if name == b"GET":
+            entry = self._live(key)
+            return self._bulk(entry[1] if entry else None)
+        if name == b"MGET":
+            return self._array([(self._live(k) or (None, None))[1] for k in args[1:]])
+        if name == b"SET":
+            options = [arg.upper() for arg in args[3:]]
+            expires = None
+            if b"PX" in options:
+                expires = time.time() + int(args[3 + options.index(b"PX") + 1]) / 1000
+            if b"NX" in options and self._live(key) is not None:
+                return b"$-1\r\n"
+            self.data[key] = (expires, args[2])
+            self._touch(key)
+            return b"+OK\r\n"
+        if name == b"DEL":
+            removed = self.data.pop(key, None) is not None
+            self._touch(key)
+            return b":%d\r\n" % removed
+        if name == b"EXISTS":
+            return b":%d\r\n" % (self._live(key) is not None)
+        if name == b"HGETALL":
+            entry = self._live(key)
+            fields = entry[1] if entry else {}
+            return self._array([item for pair in fields.items() for item in pair])
+        if name == b"HSET":
+            entry = self._live(key)
+            fields = dict(entry[1]) if entry else {}
+            for i in range(2, len(args), 2):
+                fields[args[i]] = args[i + 1]
+            self.data[key] = (None, fields)
+            self._touch(key)
+            return b":%d\r\n" % ((len(args) - 2) // 2)
+        if name == b"HDEL":
+            entry = self._live(key)
+            fields = dict(entry[1]) if entry else {}
+            removed = sum(fields.pop(field, None) is not None for field in args[2:])
+            if fields:
+                self.data[key] = (None, fields)
+            else:
+                self.data.pop(key, None)
+            self._touch(key)
+            return b":%d\r\n" % removed
+        if name == b"SCAN":
+            cursor = int(args[1])
+            pattern = redis_glob(args[args.index(b"MATCH") + 1].decode() if b"MATCH" in args else "*")
+            keys = sorted(k for k in list(self.data) if self._live(k) is not None)
+            page = keys[cursor:cursor + self.scan_page]
+            next_cursor = cursor + self.scan_page if cursor + self.scan_page < len(keys) else 0
+            matched = [k for k in page if pattern.match(k.decode())]
+            return b"*2\r\n" + self._bulk(str(next_cursor).encode()) + self._array(matched)
+        return b"-ERR unknown command '%s'\r\n" % name
@@ -0,0 +1,105 @@
+import threading
+
+import pytest
+
+from src.backends import RedisBackend, RedisError, RespConnection
+
+def test_connect_sends_auth_and_select(resp_server, redis_backend):
+    redis_backend.set("a", "1")
+    assert resp_server.commands[:2] == [[b"AUTH", b"secret"], [b"SELECT", b"2"]]
+
+def test_wrong_password_raises(resp_server):
+    backend = RedisBackend(resp_server.url(password="wrong"))
+    with pytest.raises(RedisError, match="WRONGPASS"):
+        backend.get("a")
+
+def test_unsupported_url_scheme():
+    with pytest.raises(ValueError):
+        RespConnection("rediss://localhost:6379/0")
+
+def test_get_set_delete_and_prefix(resp_server, redis_backend):
+    assert redis_backend.get("missing") is None
+    redis_backend.set("key", "значение")
+    assert redis_backend.get("key") == "значение".encode('utf-8')
+    assert b"unitech:key" in resp_server.data
+    redis_backend.delete("key")
+    assert redis_backend.get("key") is None
+
+def test_set_only_if_missing_and_ttl(resp_server, redis_backend):
+    assert redis_backend.set("key", b"first", only_if_missing=True)
+    assert not redis_backend.set("key", b"second", only_if_missing=True)
+    assert redis_backend.get("key") == b"first"
+    redis_backend.set("ttl", b"x", ttl=1.5)
+    assert [b"PX", b"1500"] == resp_server.commands[-1][3:5]
+
+def test_mget_keeps_order_and_missing_keys(redis_backend):
+    redis_backend.set("a", b"1")
+    redis_backend.set("c", b"3")
+    assert redis_backend.mget(["a", "b", "c"]) == [b"1", None, b"3"]
+    assert redis_backend.mget([]) == []
+
+def test_scan_follows_cursor_and_escapes_glob(resp_server, redis_backend):
+    for i in range(7):
+        redis_backend.set(f"user:{i}", b"x")
+    redis_backend.set("user*:odd", b"x")
+    redis_backend.set("other:1", b"x")
+    assert sorted(redis_backend.scan("user:")) == [f"user:{i}" for i in range(7)]
+    assert redis_backend.scan("user*:") == ["user*:odd"]
+    # More keys than one SCAN page: the client had to follow the cursor
+    assert sum(command[0] == b"SCAN" for command in resp_server.commands) > 2
+
+def test_reconnects_once_after_dropped_connection(resp_server, redis_backend):
+    redis_backend.set("key", b"1")
+    resp_server.drop_connections()
+    assert redis_backend.get("key") == b"1"
+
+def test_connection_failure_raises_redis_error():
+    backend = RedisBackend("redis://127.0.0.1:1/0")
+    with pytest.raises(RedisError):
+        backend.get("key")
+
+def test_server_error_does_not_poison_connection(resp_server, redis_backend):
+    with pytest.raises(RedisError, match="unknown command"):
+        redis_backend._conn.execute("NOSUCHCOMMAND")
+    assert redis_backend.set("key", b"1")
+
+def test_update_hash_sets_and_removes_fields(redis_backend):
+    redis_backend.update_hash("h", {"a": "1", "b": "2"})
+    redis_backend.update_hash("h", {"c": "3"}, remove=("a",))
+    assert redis_backend.get_hash("h") == {"b": b"2", "c": b"3"}
+    assert redis_backend.get_hashes(["h", "missing"]) == [{"b": b"2", "c": b"3"}, {}]
+
+def test_update_hash_only_if_missing(redis_backend):
+    assert redis_backend.update_hash("h", {"a": "1"}, only_if_missing=True)
+    assert not redis_backend.update_hash("h", {"a": "2"}, only_if_missing=True)
+    assert redis_backend.get_hash("h") == {"a": b"1"}
+
+def test_update_hash_only_if_missing_loses_race(resp_server, redis_backend):
+    other = RedisBackend(resp_server.url(password="secret", db=2))
+    original = redis_backend._conn._call
+
+    def call(args):
+        reply = original(args)
+        if args[0] == "EXISTS":
+            # Another worker creates the hash between the check and EXEC
+            other.update_hash("h", {"a": "other"})
+        return reply
+
+    redis_backend._conn._call = call
+    assert not redis_backend.update_hash("h", {"a": "mine"}, only_if_missing=True)
+    assert redis_backend.get_hash("h") == {"a": b"other"}
+    other.close()
+
+def test_concurrent_updates_of_different_fields_are_kept(resp_server):
+    backends = [RedisBackend(resp_server.url(password="secret")) for _ in range(4)]
+    threads = [
+        threading.Thread(target=lambda b=b, i=i: [b.update_hash("h", {f"f{i}": str(n)}) for n in range(20)])
+        for i, b in enumerate(backends)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backends[0].get_hash("h") == {f"f{i}": b"19" for i in range(4)}
+    for backend in backends:
+        backend.close()
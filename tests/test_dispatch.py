@@ -0,0 +1,43 @@
+import asyncio
+from datetime import datetime
+
+from telegram import Update
+
+from src.dispatch import ChatOrderedUpdateProcessor
+
+def _update(update_id, chat_id):
+    return Update.de_json({'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': int(datetime.now().timestamp()), 'text': "x",
+        'chat': {'id': chat_id, 'type': 'private'}, 'from': {'id': chat_id, 'is_bot': False, 'first_name': "U"},
+    }}, None)
+
+def _dispatch(processor, updates, handle):
+    # Same scheduling as Application._update_fetcher: one task per update, in arrival order
+    async def main():
+        await asyncio.gather(*(asyncio.create_task(processor.process_update(update, handle(update))) for update in updates))
+    asyncio.run(main())
+
+def test_slow_chat_does_not_hold_up_other_chats():
+    finished = []
+
+    async def handle(update):
+        # Chat 1 waits on a slow Unitech response
+        await asyncio.sleep(0.2 if update.effective_chat.id == 1 else 0)
+        finished.append(update.update_id)
+
+    _dispatch(ChatOrderedUpdateProcessor(8), [_update(1, 1), _update(2, 2), _update(3, 3)], handle)
+    assert finished == [2, 3, 1]
+
+def test_updates_of_one_chat_run_in_order():
+    events = []
+
+    async def handle(update):
+        events.append(("start", update.update_id))
+        await asyncio.sleep(0.05 if update.update_id == 1 else 0)
+        events.append(("end", update.update_id))
+
+    processor = ChatOrderedUpdateProcessor(8)
+    _dispatch(processor, [_update(1, 5), _update(2, 5), _update(3, 5)], handle)
+    assert events == [("start", 1), ("end", 1), ("start", 2), ("end", 2), ("start", 3), ("end", 3)]
+    # Locks of idle chats are not kept
+    assert processor._locks == {} and processor._waiting == {}
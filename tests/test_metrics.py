@@ -0,0 +1,59 @@
+import asyncio
+import socket
+
+from src import metrics
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _serve_once(monkeypatch, client):
+    port = _free_port()
+    monkeypatch.setattr(metrics, "METRICS_PORT", port)
+    monkeypatch.setattr(metrics, "METRICS_LISTEN", "127.0.0.1")
+
+    async def main():
+        await metrics.start_metrics_server()
+        try:
+            return await client(port)
+        finally:
+            await metrics.stop_metrics_server()
+
+    return asyncio.run(main())
+
+def test_metrics_endpoint(monkeypatch):
+    metrics.handler_seconds.observe(0.003, handler="today_command")
+
+    async def client(port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        return response
+
+    response = _serve_once(monkeypatch, client).decode()
+    assert response.startswith("HTTP/1.1 200 OK")
+    assert 'unitech_handler_duration_seconds_bucket{handler="today_command",le="0.005"}' in response
+    assert 'unitech_handler_duration_seconds_bucket{handler="today_command",le="+Inf"}' in response
+
+def test_unfinished_request_is_dropped(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_READ_TIMEOUT", 0.2)
+
+    async def client(port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /metrics HTTP/1.1\r\n")  # never sends the blank line
+        response = await asyncio.wait_for(reader.read(), 2)
+        writer.close()
+        return response
+
+    assert _serve_once(monkeypatch, client) == b""
+
+def test_instrument_handler_keeps_name_and_result():
+    async def week_command(update, context):
+        return 42
+
+    timed = metrics.instrument_handler(week_command)
+    assert timed.__name__ == "week_command"
+    assert asyncio.run(timed(None, None)) == 42
+    assert ("week_command",) in metrics.handler_seconds._series
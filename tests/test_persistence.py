@@ -0,0 +1,98 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from telegram import Bot, Update, User
+from telegram.ext import ApplicationBuilder, CommandHandler, ConversationHandler, MessageHandler, TypeHandler, filters
+
+from src.backends import RedisBackend
+from src.persistence import BackendPersistence, SharedConversationHandler, load_conversation_states
+
+WAITING = 1
+
+def test_conversation_state_roundtrip(resp_server, redis_backend):
+    persistence = BackendPersistence(redis_backend)
+
+    async def main():
+        await persistence.save_conversation("feedback", (1, 2), WAITING)
+        assert await persistence.load_conversations([("feedback", (1, 2)), ("feedback", (3, 4))]) == [WAITING, None]
+        # Nothing is preloaded and the periodic write is ignored
+        assert await persistence.get_conversations("feedback") == {}
+        await persistence.update_conversation("feedback", (1, 2), None)
+        assert await persistence.load_conversations([("feedback", (1, 2))]) == [WAITING]
+        await persistence.save_conversation("feedback", (1, 2), None)
+        assert await persistence.load_conversations([("feedback", (1, 2))]) == [None]
+
+    asyncio.run(main())
+    # Abandoned conversations expire
+    assert any(command[0] == b"SET" and b"PX" in command for command in resp_server.commands)
+
+def test_chat_and_user_data_roundtrip(redis_backend):
+    persistence = BackendPersistence(redis_backend)
+
+    async def main():
+        await persistence.update_chat_data(5, {'a': 1})
+        await persistence.update_user_data(6, {'b': 2})
+        await persistence.update_bot_data({'c': 3})
+        assert await persistence.get_chat_data() == {5: {'a': 1}}
+        assert await persistence.get_user_data() == {6: {'b': 2}}
+        assert await persistence.get_bot_data() == {'c': 3}
+        await persistence.drop_chat_data(5)
+        assert await persistence.get_chat_data() == {}
+
+    asyncio.run(main())
+
+@pytest.fixture
+def offline_bot(monkeypatch):
+    async def get_me(self, *args, **kwargs):
+        self._bot_user = User(1, "Bot", True, username="test_bot")
+        return self._bot_user
+
+    monkeypatch.setattr(Bot, "get_me", get_me)
+
+def _update(update_id, text, bot):
+    message = {
+        'message_id': update_id, 'date': int(datetime.now().timestamp()), 'text': text,
+        'chat': {'id': 10, 'type': 'private'}, 'from': {'id': 20, 'is_bot': False, 'first_name': "U"},
+    }
+    if text.startswith("/"):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+    return Update.de_json({'update_id': update_id, 'message': message}, bot)
+
+def test_conversation_continues_on_another_worker(resp_server, offline_bot):
+    received = []
+
+    async def ask(update, context):
+        return WAITING
+
+    def worker(name):
+        async def receive(update, context):
+            received.append((name, update.message.text))
+            return ConversationHandler.END
+
+        backend = RedisBackend(resp_server.url(password="secret"))
+        app = ApplicationBuilder().token("1:x").persistence(BackendPersistence(backend)).build()
+        app.add_handler(TypeHandler(Update, load_conversation_states), group=-1)
+        app.add_handler(SharedConversationHandler(
+            entry_points=[CommandHandler("change", ask)],
+            states={WAITING: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive)]},
+            fallbacks=[],
+            name="student_group",
+            persistent=True,
+        ))
+        return app
+
+    async def main():
+        worker_a, worker_b = worker("a"), worker("b")
+        await worker_a.initialize()
+        await worker_b.initialize()
+        # Both workers are running before the flow starts, so B has no startup snapshot of it
+        await worker_a.process_update(_update(1, "/change", worker_a.bot))
+        await worker_b.process_update(_update(2, "ПИ-23", worker_b.bot))
+        # The flow ended on B: A no longer treats text as an answer
+        await worker_a.process_update(_update(3, "ИБ-21", worker_a.bot))
+        await worker_a.shutdown()
+        await worker_b.shutdown()
+
+    asyncio.run(main())
+    assert received == [("b", "ПИ-23")]
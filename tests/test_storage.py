@@ -0,0 +1,67 @@
+import asyncio
+import threading
+
+from src import storage
+from src.backends import RedisBackend
+from src.storage import BackendUserStore
+
+def test_backend_user_store_roundtrip(redis_backend):
+    store = BackendUserStore(redis_backend)
+    assert store.get_user("1") == {}
+    store.create_user("1", {'id_student': 90893})
+    store.create_user("1", {'id_student': 1})  # existing chats are not reset
+    assert store.get_user("1") == {'id_student': 90893}
+
+    store.set_student("1", 500, "ПИ-23", 7)
+    assert store.get_user("1") == {'id_student': 500, 'group_name': "ПИ-23", 'group_id': 7}
+    store.set_teacher("1", 9, "Иванов И.И.")
+    assert store.get_user("1") == {'id_teacher': 9, 'teacher_name': "Иванов И.И."}
+    store.set_student("1", 501, "ИБ-21")
+    assert store.get_user("1") == {'id_student': 501, 'group_name': "ИБ-21"}
+
+def test_backend_user_store_iter_and_import(redis_backend):
+    store = BackendUserStore(redis_backend)
+    store.create_user("1", {'id_student': 1})
+    imported = store.import_users([("1", {'id_student': 2}), ("2", {'id_teacher': 3})])
+    assert imported == 1
+    assert dict(store.iter_users()) == {"1": {'id_student': 1}, "2": {'id_teacher': 3}}
+    assert len(store) == 2
+
+def test_concurrent_updates_from_two_workers_are_not_lost(resp_server):
+    backends = [RedisBackend(resp_server.url(password="secret")) for _ in range(2)]
+    worker_a, worker_b = (BackendUserStore(backend) for backend in backends)
+    worker_a.set_student("1", 500, "ПИ-23")
+
+    # Worker A attaches the group_id while worker B changes the group name of the same chat
+    threads = [
+        threading.Thread(target=lambda: [worker_a.set_group_id("1", 7) for _ in range(30)]),
+        threading.Thread(target=lambda: [worker_b._update("1", {'group_name': "ПИ-23"}, ()) for _ in range(30)]),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert worker_a.get_user("1") == {'id_student': 500, 'group_name': "ПИ-23", 'group_id': 7}
+    for backend in backends:
+        backend.close()
+
+def test_module_functions_run_backend_store_in_thread(redis_backend, monkeypatch):
+    monkeypatch.setattr(storage, "_store", BackendUserStore(redis_backend))
+    threads = []
+    to_thread = asyncio.to_thread
+
+    async def recording_to_thread(func, *args):
+        threads.append(func)
+        return await to_thread(func, *args)
+
+    monkeypatch.setattr(asyncio, "to_thread", recording_to_thread)
+
+    async def main():
+        await storage.create_user("5", {'id_student': 90893})
+        await storage.set_teacher("5", 9, "T")
+        return await storage.get_user("5"), await storage.iter_users()
+
+    user, users = asyncio.run(main())
+    assert user == {'id_teacher': 9, 'teacher_name': "T"}
+    assert users == [("5", user)]
+    assert len(threads) == 4
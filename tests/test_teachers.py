@@ -0,0 +1,59 @@
+import asyncio
+
+import httpx
+import pytest
+
+from src import get_student_id
+
+class Response:
+    def __init__(self, teachers):
+        self._teachers = teachers
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {'data': self._teachers}
+
+@pytest.fixture
+def teacher_list(monkeypatch):
+    state = {'teachers': [{'id': 9, 'name': "Иванов Иван Иванович"}], 'calls': 0, 'down': False}
+
+    async def get(path, params=None, **kwargs):
+        assert path == "/raspTeacherlist"
+        state['calls'] += 1
+        await asyncio.sleep(0.01)
+        if state['down']:
+            raise httpx.ConnectError("unitech is down")
+        return Response(state['teachers'])
+
+    monkeypatch.setattr(get_student_id.http_client, "get", get)
+    monkeypatch.setattr(get_student_id, "_teacher_index", None)
+    monkeypatch.setattr(get_student_id, "_teacher_index_loaded_at", None)
+    return state
+
+def test_teacher_list_is_fetched_once_while_fresh(teacher_list):
+    async def main():
+        return await asyncio.gather(*(get_student_id.get_teacher(9) for _ in range(5)))
+
+    assert [teacher['name'] for teacher in asyncio.run(main())] == ["Иванов Иван Иванович"] * 5
+    assert teacher_list['calls'] == 1
+
+def test_expired_teacher_list_is_refetched(teacher_list, monkeypatch):
+    asyncio.run(get_student_id.get_teacher_index())
+    teacher_list['teachers'] = [{'id': 10, 'name': "Петрова Анна Сергеевна"}]
+    monkeypatch.setattr(get_student_id, "TEACHERS_CACHE_TTL", 0)
+    assert asyncio.run(get_student_id.get_teacher(10))['name'] == "Петрова Анна Сергеевна"
+    assert teacher_list['calls'] == 2
+
+def test_failed_refresh_keeps_previous_list(teacher_list, monkeypatch):
+    asyncio.run(get_student_id.get_teacher_index())
+    teacher_list['down'] = True
+    monkeypatch.setattr(get_student_id, "TEACHERS_CACHE_TTL", 0)
+    asyncio.run(get_student_id.refresh_teachers())
+    assert asyncio.run(get_student_id.get_teacher(9))['name'] == "Иванов Иван Иванович"
+
+def test_no_list_when_never_fetched(teacher_list):
+    teacher_list['down'] = True
+    assert asyncio.run(get_student_id.get_teacher_index()) is None
+    assert asyncio.run(get_student_id.find_teacher("Иванов")) == []